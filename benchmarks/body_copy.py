@@ -0,0 +1,97 @@
+"""
+Compares the per chunk body copy (8 KiB reads, every chunk accounted and written on its own)
+with the buffered copy of core.body_copy against a local aiohttp server.
+
+Usage: python -m benchmarks.body_copy [--size 512] [--repeat 3] [--buffer-size 1024]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from aiohttp import web
+
+from core import io_executor
+from core.body_copy import copy_body
+from core.monitor import MonitorSession
+from core.stall_watchdog import StallWatchdog
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+
+class CountingSignal(object):
+    def __init__(self):
+        self.count = 0
+
+    def emit(self, length):
+        self.count += 1
+
+
+class Signals(object):
+    def __init__(self):
+        self.downloaded_content_length = CountingSignal()
+
+
+async def start_server(size):
+    data = os.urandom(size)
+
+    async def handler(request):
+        return web.Response(body=data, content_type="application/octet-stream")
+
+    app = web.Application()
+    app.router.add_get("/file", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, HOST, PORT)
+    await site.start()
+    return runner
+
+
+async def download(buffer_size, path, repeat):
+    signals = Signals()
+    watchdog = StallWatchdog(idle_timeout=60, min_speed=0)
+    async with MonitorSession(signals) as session:
+        start_time = time.perf_counter()
+        start_cpu = time.process_time()
+        total = 0
+        for _ in range(repeat):
+            async with session.get(f"http://{HOST}:{PORT}/file") as response:
+                async with io_executor.open_writer(path, "wb") as f:
+                    await copy_body(response, f, watchdog, buffer_size)
+            total += os.path.getsize(path)
+        elapsed = time.perf_counter() - start_time
+        cpu = time.process_time() - start_cpu
+    return total, elapsed, cpu, signals.downloaded_content_length.count
+
+
+async def run(size, repeat, buffer_size):
+    runner = await start_server(size)
+    path = os.path.join(tempfile.mkdtemp(), "file.bin")
+    try:
+        for name, size_bytes in [("8 KiB chunks", 0), (f"{buffer_size} KiB buffers", buffer_size * 1024)]:
+            total, elapsed, cpu, signal_count = await download(size_bytes, path, repeat)
+            gigabytes = total / 1024 ** 3
+            print(f"{name:>17}: {total / 1024 ** 2 / elapsed:8.1f} MB/s, "
+                  f"{cpu / gigabytes:6.2f} CPU s/GB, {signal_count:7d} signals")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        os.rmdir(os.path.dirname(path))
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=512, help="size of the served file in MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--buffer-size", type=int, default=1024, help="buffer size of the fast path in KB")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(args.size * 1024 * 1024, args.repeat, args.buffer_size))
+
+
+if __name__ == "__main__":
+    main()
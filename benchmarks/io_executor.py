@@ -0,0 +1,144 @@
+"""
+Compares writing many small files directly on the event loop with
+writing them through core.io_executor on a simulated slow filesystem
+(every filesystem call sleeps for --latency milliseconds, like a NAS).
+
+Usage: python -m benchmarks.io_executor [--files 400] [--size 65536] [--latency 2]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from core import io_executor
+
+CHUNK_SIZE = 8192
+
+
+class SlowFile(object):
+    def __init__(self, file, latency):
+        self.file = file
+        self.latency = latency
+
+    def write(self, data):
+        time.sleep(self.latency)
+        return self.file.write(data)
+
+    def seek(self, offset):
+        return self.file.seek(offset)
+
+    def close(self):
+        time.sleep(self.latency)
+        return self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def make_slow(func, latency):
+    def wrapper(*args, **kwargs):
+        time.sleep(latency)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def patch_filesystem(latency):
+    original_open = open
+
+    def slow_open(*args, **kwargs):
+        time.sleep(latency)
+        return SlowFile(original_open(*args, **kwargs), latency)
+
+    io_executor.open = slow_open
+    os.path.exists = make_slow(os.path.exists, latency)
+    os.makedirs = make_slow(os.makedirs, latency)
+    os.replace = make_slow(os.replace, latency)
+    return slow_open
+
+
+async def network_chunks(size):
+    data = os.urandom(CHUNK_SIZE)
+    sent = 0
+    while sent < size:
+        await asyncio.sleep(0)
+        yield data[:min(CHUNK_SIZE, size - sent)]
+        sent += CHUNK_SIZE
+
+
+async def write_blocking(slow_open, path, size):
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with slow_open(path + ".part", "wb") as f:
+        async for chunk in network_chunks(size):
+            f.write(chunk)
+    os.replace(path + ".part", path)
+
+
+async def write_executor(slow_open, path, size):
+    if await io_executor.exists(path):
+        return
+    await io_executor.run(os.makedirs, os.path.dirname(path), exist_ok=True)
+    async with io_executor.open_writer(path + ".part", "wb") as f:
+        async for chunk in network_chunks(size):
+            await f.write(chunk)
+    await io_executor.replace(path + ".part", path)
+
+
+async def measure_lag(stop, result):
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(0.005)
+        result.append(time.perf_counter() - t - 0.005)
+
+
+async def run(write, slow_open, base_path, files, size, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            path = os.path.join(base_path, f"dir{i % 20}", f"file{i}.bin")
+            await write(slow_open, path, size)
+
+    lags = []
+    stop = asyncio.Event()
+    lag_task = asyncio.ensure_future(measure_lag(stop, lags))
+    t = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(files)])
+    elapsed = time.perf_counter() - t
+    stop.set()
+    await lag_task
+    return elapsed, max(lags, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--size", type=int, default=64 * 1024)
+    parser.add_argument("--latency", type=float, default=2, help="milliseconds per filesystem call")
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    slow_open = patch_filesystem(args.latency / 1000)
+    loop = asyncio.get_event_loop()
+
+    for name, write in [("event loop", write_blocking), ("io executor", write_executor)]:
+        base_path = tempfile.mkdtemp()
+        try:
+            elapsed, max_lag = loop.run_until_complete(
+                run(write, slow_open, base_path, args.files, args.size, args.concurrency))
+        finally:
+            shutil.rmtree(base_path)
+        total_mb = args.files * args.size / 1024 / 1024
+        print(f"{name:>12}: {args.files / elapsed:8.1f} files/s, {total_mb / elapsed:7.2f} MB/s, "
+              f"max event loop lag {max_lag * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
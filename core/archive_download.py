@@ -0,0 +1,204 @@
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+
+from core import io_executor
+from core.body_copy import copy_body, get_buffer_size
+from core.constants import PART_EXTENSION
+from core.downloader import is_extension_forbidden
+from core.stall_watchdog import create_download_timeout, create_watchdog
+from core.storage import cache
+from core.storage.constants import ARCHIVE_TEMP_PATH
+from core.utils import get_extension, safe_path_join
+
+logger = logging.getLogger(__name__)
+
+MIN_ARCHIVE_FILES = 5
+EXTRACT_BUFFER_SIZE = 1024 * 1024
+
+
+class ItemCollector(object):
+    """Collects the items a producer puts, so they can be passed to put_folder_items"""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.consumer_kwargs = queue.consumer_kwargs
+        self.items = []
+
+    async def put(self, item):
+        self.items.append(item)
+
+    def record(self, item):
+        self.queue.record(item)
+
+
+async def put_folder_items(session, queue, items, archive_url, folder_path, session_kwargs=None):
+    """
+    Puts the items of a folder into the queue.
+    If the folder is new or more than `archive_download_threshold` percent of its files are missing locally,
+    the folder is downloaded once as zip from `archive_url` and the missing files are extracted instead.
+    All other files are put into the queue, so changed files keep their conditional request.
+    """
+    site_settings = queue.consumer_kwargs["site_settings"]
+    pending = await get_pending_items(queue, items, site_settings, extractable=True)
+    if has_filtered_items(queue, items, site_settings) or \
+            not await use_archive(items, pending, folder_path, site_settings):
+        for item in items:
+            await queue.put(item)
+        return
+
+    extracted = []
+    try:
+        extracted = await download_archive(session, queue, pending, archive_url, folder_path,
+                                           site_settings, session_kwargs)
+    except Exception as e:
+        logger.warning(f"Could not download the archive {archive_url}. {type(e).__name__}: {e}")
+
+    extracted_ids = {id(item) for item in extracted}
+    for item in items:
+        if id(item) in extracted_ids:
+            queue.record(item)
+        else:
+            await queue.put(item)
+
+
+def get_extension_filters(queue, site_settings):
+    allowed_extensions = (queue.consumer_kwargs.get("allowed_extensions", None) or []) + \
+                         site_settings.allowed_extensions
+    forbidden_extensions = (queue.consumer_kwargs.get("forbidden_extensions", None) or []) + \
+                           site_settings.forbidden_extensions
+    return allowed_extensions, forbidden_extensions
+
+
+def has_filtered_items(queue, items, site_settings):
+    """
+    Returns whether the extension filters could skip an item. The archive would contain it anyway,
+    e.g. large forbidden videos. Items without a known extension count as filtered.
+    """
+    allowed_extensions, forbidden_extensions = get_extension_filters(queue, site_settings)
+    for item in items:
+        if not item.get("with_extension", True):
+            return True
+        if is_extension_forbidden(extension=get_extension(os.path.basename(item["path"])),
+                                  allowed_extensions=allowed_extensions,
+                                  forbidden_extensions=forbidden_extensions):
+            return True
+    return False
+
+
+async def get_pending_items(queue, items, site_settings, extractable=False):
+    """
+    Returns the items which the downloader would download.
+    With `extractable` only the ones which can be extracted from an archive, which are the missing ones.
+    """
+    allowed_extensions, forbidden_extensions = get_extension_filters(queue, site_settings)
+
+    pending = []
+    for item in items:
+        absolute_path = os.path.join(site_settings.base_path, item["path"])
+        if not item.get("with_extension", True):
+            if extractable:
+                continue
+            extension = cache.get_cached_extension(str(item["url"]))
+            if extension is None or extension == cache.EXTENSION_ERROR:
+                pending.append(item)
+                continue
+            absolute_path += "." + extension
+
+        if is_extension_forbidden(extension=get_extension(os.path.basename(absolute_path)),
+                                  allowed_extensions=allowed_extensions,
+                                  forbidden_extensions=forbidden_extensions):
+            continue
+
+        if not await io_executor.exists(absolute_path):
+            pending.append(item)
+        elif not extractable and not cache.is_checksum_same(absolute_path, item.get("checksum", None)):
+            pending.append(item)
+
+    return pending
+
+
+async def use_archive(items, pending, folder_path, site_settings):
+    if not site_settings.archive_download_threshold or len(pending) < MIN_ARCHIVE_FILES:
+        return False
+
+    if not await io_executor.exists(os.path.join(site_settings.base_path, folder_path)):
+        return True
+
+    return len(pending) * 100 > len(items) * site_settings.archive_download_threshold
+
+
+async def download_archive(session, queue, pending, archive_url, folder_path, site_settings, session_kwargs):
+    logger.debug(f"Downloading {len(pending)} file(s) of {folder_path} as archive")
+    file_descriptor, archive_path = await io_executor.run(tempfile.mkstemp, suffix=".zip",
+                                                          dir=ARCHIVE_TEMP_PATH)
+    await io_executor.run(os.close, file_descriptor)
+    try:
+        async with session.get(archive_url, timeout=create_download_timeout(site_settings),
+                               **(session_kwargs or {})) as response:
+            async with io_executor.open_writer(archive_path, "wb") as f:
+                await copy_body(response, f, create_watchdog(site_settings), get_buffer_size(site_settings))
+
+        members = map_members(pending, folder_path)
+        found = {member: item for item, member in await io_executor.run(find_members, archive_path, members)}
+        extracted_members = await io_executor.run(extract_members, archive_path,
+                                                  [(member, os.path.join(site_settings.base_path, item["path"]))
+                                                   for member, item in found.items()])
+
+        extracted = []
+        for member in extracted_members:
+            item = found[member]
+            absolute_path = os.path.join(site_settings.base_path, item["path"])
+            cache.save_checksum(absolute_path, item.get("checksum", None))
+            signal_finished_file(queue, absolute_path)
+            extracted.append(item)
+    finally:
+        await io_executor.remove_if_exists(archive_path)
+
+    return extracted
+
+
+def map_members(items, folder_path):
+    return {os.path.normpath(os.path.relpath(item["path"], folder_path)): item for item in items}
+
+
+def find_members(archive_path, members):
+    """Matches the members of the archive to the items. Archives may contain additional parent folders"""
+    result = []
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            parts = [part for part in info.filename.split("/") if part]
+            for index in range(len(parts)):
+                item = members.pop(os.path.normpath(safe_path_join("", *parts[index:])), None)
+                if item is not None:
+                    result.append((item, info.filename))
+                    break
+    return result
+
+
+def extract_members(archive_path, members):
+    """Extracts the members to their paths and returns the extracted ones. Existing files are never replaced"""
+    extracted = []
+    with zipfile.ZipFile(archive_path) as archive:
+        for member, absolute_path in members:
+            if os.path.exists(absolute_path):
+                continue
+            os.makedirs(os.path.dirname(absolute_path), exist_ok=True)
+            part_path = f"{absolute_path}.{PART_EXTENSION}"
+            with archive.open(member) as source, open(part_path, "wb") as target:
+                shutil.copyfileobj(source, target, EXTRACT_BUFFER_SIZE)
+
+            os.replace(part_path, absolute_path)
+            extracted.append(member)
+    return extracted
+
+
+def signal_finished_file(queue, absolute_path):
+    signal_handler = queue.consumer_kwargs["signal_handler"]
+    unique_key = queue.consumer_kwargs["unique_key"]
+    signal_handler.added_new_file(unique_key, absolute_path)
+    logger.info(f"Added new file: '{os.path.basename(absolute_path)}' from archive")
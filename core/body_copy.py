@@ -0,0 +1,61 @@
+from core.monitor import MonitoredRead
+
+LEGACY_CHUNK_SIZE = 8192
+
+
+def get_buffer_size(site_settings):
+    return site_settings.download_buffer_size * 1024
+
+
+async def copy_body(response, writer, watchdog, buffer_size):
+    """
+    Copies the body of `response` into `writer`.
+    With a buffer size of 0 every chunk of at most 8 KiB is written and accounted on its own.
+    Otherwise the body is read into two reused buffers, which are accounted once they are full
+    and written while the other one is filled.
+    """
+    if not buffer_size:
+        await _copy_chunks(response, writer, watchdog)
+        return
+
+    read, account = get_raw_read(response)
+    buffers = [bytearray(buffer_size), bytearray(buffer_size)]
+    index = 0
+    while True:
+        buffer = buffers[index]
+        length = await _fill_buffer(read, buffer, watchdog)
+        if length:
+            if account is not None:
+                await watchdog.account(account, length)
+            await writer.write_through(memoryview(buffer)[:length])
+        if length < buffer_size:
+            break
+        index = 1 - index
+
+
+async def _copy_chunks(response, writer, watchdog):
+    while True:
+        chunk = await watchdog.read(response.content.read, LEGACY_CHUNK_SIZE)
+        if not chunk:
+            break
+        await writer.write(chunk)
+
+
+async def _fill_buffer(read, buffer, watchdog):
+    view = memoryview(buffer)
+    length = 0
+    while length < len(buffer):
+        chunk = await watchdog.read(read, len(buffer) - length)
+        if not chunk:
+            break
+        view[length:length + len(chunk)] = chunk
+        length += len(chunk)
+    return length
+
+
+def get_raw_read(response):
+    """Returns the unmonitored read function of the response and the function to account read bytes"""
+    read = response.content.read
+    if isinstance(read, MonitoredRead):
+        return read.func, read.account
+    return read, None
@@ -0,0 +1,148 @@
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+ADJUST_INTERVAL = 2
+MIN_CONSUMERS = 2
+THROTTLE_STATUSES = {429, 503}
+MAX_ERROR_RATE = 0.1
+LATENCY_FACTOR = 2
+DECREASE_FACTOR = 0.5
+LATENCY_DECREASE_FACTOR = 0.8
+
+
+class WindowStats(object):
+    def __init__(self):
+        self.bytes = 0
+        self.responses = 0
+        self.errors = 0
+        self.throttled = 0
+        self.latency = 0
+
+    @property
+    def error_rate(self):
+        requests = self.responses + self.errors
+        if not requests:
+            return 0
+        return self.errors / requests
+
+    @property
+    def average_latency(self):
+        if not self.responses:
+            return None
+        return self.latency / self.responses
+
+
+class ConcurrencyController(object):
+    """
+    Adjusts the number of active downloads and the connections per host with AIMD:
+    the limits grow by one while the throughput keeps up and shrink multiplicatively
+    on errors, throttling (429/503) or rising latency.
+    The configured settings are the upper bounds.
+    """
+
+    def __init__(self, queue, max_consumers, max_per_host, interval=ADJUST_INTERVAL):
+        self.queue = queue
+        self.max_consumers = max_consumers
+        self.max_per_host = max_per_host or max_consumers
+        self.interval = interval
+
+        self.limit = min(max_consumers, max(MIN_CONSUMERS, max_consumers // 2))
+        self.active = 0
+        self.max_active = 0
+        self._change = asyncio.Event()
+
+        self.base_latency = None
+        self.last_throughput = 0
+        self._window = WindowStats()
+        self._host_windows = collections.defaultdict(WindowStats)
+        self._window_start = time.monotonic()
+
+    async def acquire(self):
+        while self.active >= self.limit:
+            self._change.clear()
+            await self._change.wait()
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+
+    def release(self):
+        self.active -= 1
+        self._change.set()
+
+    def record_response(self, host, status, latency):
+        for window in (self._window, self._host_windows[host]):
+            window.responses += 1
+            window.latency += latency
+            if status in THROTTLE_STATUSES:
+                window.throttled += 1
+            elif status >= 500:
+                window.errors += 1
+        self._maybe_adjust()
+
+    def record_error(self, host):
+        self._window.errors += 1
+        self._host_windows[host].errors += 1
+        self._maybe_adjust()
+
+    def record_bytes(self, host, length):
+        self._window.bytes += length
+        self._host_windows[host].bytes += length
+        self._maybe_adjust()
+
+    def _maybe_adjust(self):
+        elapsed = time.monotonic() - self._window_start
+        if elapsed < self.interval:
+            return
+
+        self._adjust_consumers(elapsed)
+        for host, window in self._host_windows.items():
+            self._adjust_host(host, window)
+
+        self._window = WindowStats()
+        self._host_windows.clear()
+        self._window_start = time.monotonic()
+        self.max_active = self.active
+
+    def _adjust_consumers(self, elapsed):
+        window = self._window
+        throughput = window.bytes / elapsed
+        latency = window.average_latency
+        old_limit = self.limit
+
+        if latency is not None:
+            if self.base_latency is None or latency < self.base_latency:
+                self.base_latency = latency
+
+        if window.throttled or window.error_rate > MAX_ERROR_RATE:
+            self.limit = max(MIN_CONSUMERS, int(self.limit * DECREASE_FACTOR))
+        elif latency is not None and latency > LATENCY_FACTOR * self.base_latency:
+            self.limit = max(MIN_CONSUMERS, int(self.limit * LATENCY_DECREASE_FACTOR))
+        elif self.max_active >= self.limit and throughput >= self.last_throughput * 0.95:
+            self.limit = min(self.max_consumers, self.limit + 1)
+
+        self.last_throughput = throughput
+
+        if self.limit != old_limit:
+            logger.debug(f"Changed download limit from {old_limit} to {self.limit}. "
+                         f"Throughput: {throughput / 1024:.0f} KiB/s, errors: {window.errors}, "
+                         f"throttled: {window.throttled}")
+            self._change.set()
+
+    def _adjust_host(self, host, window):
+        limit = self.queue.get_host_limit(host) or self.max_per_host
+        active = self.queue.host_active().get(host, 0)
+        queued = self.queue.host_depths().get(host, 0)
+
+        if window.throttled or window.error_rate > MAX_ERROR_RATE:
+            new_limit = max(1, int(limit * DECREASE_FACTOR))
+        elif active >= limit and queued:
+            new_limit = min(self.max_per_host, limit + 1)
+        else:
+            return
+
+        if new_limit != limit:
+            logger.debug(f"Changed connection limit of {host} from {limit} to {new_limit}")
+            self.queue.set_host_limit(host, new_limit)
@@ -29,9 +29,12 @@ else:
 FORCE_DOWNLOAD_BLACKLIST = ["ilias-app2.let.ethz.ch", "polybox.ethz.ch", "ssrweb.zoom.us"]
 
 MOVIE_EXTENSIONS = {"mp4", "webm", "avi", "mkv", "mov", "m4v"}
+LARGE_FILE_SIZE = 100 * 1024 * 1024
 ACTION_NEW = 0
 ACTION_REPLACE = 1
 
+PART_EXTENSION = "part"
+
 CORE_PATH = os.path.dirname(__file__)
 
 ROOT_PATH = os.path.dirname(CORE_PATH)
@@ -1,37 +1,79 @@
 import asyncio
+import filecmp
 import functools
-import pathlib
 from urllib.parse import urlparse
 import itertools
 
 import aiohttp
 from aiohttp.client import URL
 
-from core import pdf_highlighter
+from core import pdf_highlighter, io_executor
+from core.body_copy import copy_body, get_buffer_size
 from core.constants import *
+from core.exceptions import StallError
+from core.segmented_download import download_segments, get_connection_count, get_pending_ranges, \
+    get_segment_count, preallocate_file, split_into_segments, use_segments
+from core.stall_watchdog import create_download_timeout, create_watchdog
 from core.storage import cache
-from core.utils import get_extension, fit_sections_to_console, split_name_extension
+from core.retry import MAX_ATTEMPTS, get_retry_after, get_retry_delay, is_transient
+from core.unique_queue import get_host
+from core.utils import get_extension, fit_sections_to_console, split_name_extension, get_validator, \
+    get_content_range_start, get_extension_from_response
 
 logger = logging.getLogger(__name__)
 
 
-async def download_files(session: aiohttp.ClientSession, queue):
+async def download_files(session: aiohttp.ClientSession, queue, controller=None, statistics=None):
     while True:
         item = await queue.get()
+        if controller is not None:
+            try:
+                await controller.acquire()
+            except asyncio.CancelledError as e:
+                queue.task_done(item)
+                raise e
+
         unique_key = item["unique_key"]
         signal_handler = item["signal_handler"]
         try:
             await download_if_not_exist(session, **item)
+            cache.remove_dead_letter(item["path"])
         except asyncio.CancelledError:
             return
         except Exception as e:
+            if controller is not None and isinstance(e, (aiohttp.ClientPayloadError, StallError,
+                                                         asyncio.TimeoutError)):
+                controller.record_error(get_host(item))
+            if statistics is not None and isinstance(e, StallError):
+                statistics.record("stalled downloads")
+
+            attempt = item.get("attempt", 0)
+            if is_transient(e) and attempt + 1 < MAX_ATTEMPTS:
+                delay = get_retry_delay(attempt, retry_after=get_retry_after(e))
+                logger.warning(f"Could not download file from url: {item['url']}. {type(e).__name__}: {e}. "
+                               f"Retrying in {delay:.0f} seconds")
+                item["attempt"] = attempt + 1
+                if statistics is not None:
+                    statistics.record("retries")
+                signal_handler.start(unique_key)  # the retried item sends its own finish signal
+                queue.put_later(item, delay)
+                continue
+
+            if is_transient(e):
+                cache.add_dead_letter(item["path"], item["url"], f"{type(e).__name__}: {e}", attempt + 1,
+                                      unique_key=unique_key)
+            if statistics is not None:
+                statistics.record("failed downloads")
+
             logger.error(f"Consumer got an unexpected error: {type(e).__name__}: {e}", exc_info=True)
             signal_handler.got_error(unique_key,
                                      f"Could not download file from url: {item['url']}. {type(e).__name__}: {e}")
 
         finally:
             signal_handler.finished(unique_key)
-            queue.task_done()
+            queue.task_done(item)
+            if controller is not None:
+                controller.release()
 
 
 def merge_extension_filter(extensions):
@@ -66,7 +108,9 @@ async def download_if_not_exist(session,
                                 forbidden_extensions=None,
                                 checksum=None,
                                 signal_handler=None,
-                                unique_key=None):
+                                unique_key=None,
+                                attempt=0,
+                                size=None):
     if session_kwargs is None:
         session_kwargs = {}
 
@@ -76,90 +120,187 @@ async def download_if_not_exist(session,
     if forbidden_extensions is None:
         forbidden_extensions = []
 
-    allowed_extensions += site_settings.allowed_extensions
-    forbidden_extensions += site_settings.forbidden_extensions
+    allowed_extensions = allowed_extensions + site_settings.allowed_extensions
+    forbidden_extensions = forbidden_extensions + site_settings.forbidden_extensions
 
     if isinstance(url, str):
         url = URL(url)
 
     domain = url.host
 
-    timeout = aiohttp.ClientTimeout(total=0)
+    timeout = create_download_timeout(site_settings)
     if os.path.isabs(path):
         raise ValueError("Absolutes paths are not allowed")
 
     absolute_path = os.path.join(site_settings.base_path, path)
+    if attempt:
+        logger.debug(f"Attempt {attempt + 1} to download {url}")
 
+    discovery_response = None
     if not with_extension:
-        guess_extension = await cache.check_extension(session, str(url), session_kwargs=session_kwargs)
-        if guess_extension is None:
+        extension = cache.get_cached_extension(str(url))
+        if extension is None:
+            discovery_response = await session.get(url, timeout=timeout, raise_for_status=True, **session_kwargs)
+            try:
+                extension = get_extension_from_response(discovery_response)
+            except BaseException as e:
+                discovery_response.release()
+                raise e
+            cache.save_extension(str(url), extension)
+            logger.debug(f"Got extension from response, url: {url}, extension: {extension}")
+
+        if extension is None or extension == cache.EXTENSION_ERROR:
+            release_response(discovery_response)
             logger.warning(f"Could not retrieve the extension for {url}")
             return
 
-        absolute_path += "." + guess_extension
+        absolute_path += "." + extension
 
-    force = False
-    if checksum is not None:
-        force = not cache.is_checksum_same(absolute_path, checksum)
-    elif site_settings.force_download and domain not in FORCE_DOWNLOAD_BLACKLIST:
-        force = True
+    reuse_response = False
+    try:
+        force = False
+        if checksum is not None:
+            force = not cache.is_checksum_same(absolute_path, checksum)
+        elif site_settings.force_download and domain not in FORCE_DOWNLOAD_BLACKLIST:
+            force = True
 
-    if os.path.exists(absolute_path) and not force:
-        return
+        part_path = f"{absolute_path}.{PART_EXTENSION}"
+        file_exists = await io_executor.exists(absolute_path)
+        if file_exists and not force:
+            await discard_part_file(absolute_path, part_path)
+            return
+
+        session_kwargs = dict(session_kwargs)
+        headers = dict(session_kwargs.get("headers", {}))
+
+        if file_exists:
+            etag = cache.get_etag(absolute_path)
+            if etag is not None:
+                headers["If-None-Match"] = etag
+
+        if file_exists:
+            action = ACTION_REPLACE
+        else:
+            action = ACTION_NEW
+
+        file_name = os.path.basename(absolute_path)
+        file_extension = get_extension(file_name)
+        if is_extension_forbidden(extension=file_extension,
+                                  forbidden_extensions=forbidden_extensions,
+                                  allowed_extensions=allowed_extensions):
+            return
+
+        offset, validator, segments = await get_resume_state(absolute_path, part_path)
+        if segments is not None:
+            start, end = get_pending_ranges(segments)[0]
+            headers["Range"] = f"bytes={start}-{end}"
+            headers["If-Range"] = validator
+        elif offset:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
 
-    if os.path.exists(absolute_path):
-        headers = session_kwargs.get("headers", {})
-        etag = cache.get_etag(absolute_path)
-        if etag is not None:
-            headers["If-None-Match"] = etag
+        request_kwargs = dict(session_kwargs)
         if headers:
-            session_kwargs["headers"] = headers
+            request_kwargs["headers"] = headers
 
-    if os.path.exists(absolute_path):
-        action = ACTION_REPLACE
+        reuse_response = discovery_response is not None and not offset and segments is None and not file_exists
+    finally:
+        if not reuse_response:
+            release_response(discovery_response)
+
+    if reuse_response:
+        logger.debug(f"Reusing the response of the extension lookup for {url}")
+        response_context = discovery_response
     else:
-        action = ACTION_NEW
+        response_context = session.get(url, timeout=timeout, raise_for_status=False, **request_kwargs)
 
-    file_name = os.path.basename(absolute_path)
-    file_extension = get_extension(file_name)
-    if is_extension_forbidden(extension=file_extension,
-                              forbidden_extensions=forbidden_extensions,
-                              allowed_extensions=allowed_extensions):
-        return
+    async with response_context as response:
+        if response.status == 416 and "Range" in headers:
+            logger.debug(f"Range of {part_path} not satisfiable. Discarding partial file")
+            await discard_part_file(absolute_path, part_path)
 
-    async with session.get(url, timeout=timeout, **session_kwargs) as response:
         response.raise_for_status()
         response_headers = response.headers
 
         if response.status == 304:
             logger.debug(f"File '{absolute_path}' not modified")
+            await discard_part_file(absolute_path, part_path)
             cache.save_checksum(absolute_path, checksum)
             return
 
-        if file_extension.lower() in MOVIE_EXTENSIONS:
+        if response.status == 206:
+            range_start = get_content_range_start(response_headers)
+            if segments is not None and range_start == get_pending_ranges(segments)[0][0]:
+                logger.debug(f"Resuming segmented download of {file_name}")
+            elif segments is None and range_start == offset:
+                logger.debug(f"Resuming download of {file_name} at byte {offset}")
+            else:
+                await discard_part_file(absolute_path, part_path)
+                raise ValueError(f"Server answered with an unexpected range for {url}")
+            validator = get_validator(response_headers) or validator
+            mode = "ab"
+        else:
+            validator = get_validator(response_headers)
+            segments = None
+            mode = "wb"
+            if validator is not None and use_segments(response, site_settings) and \
+                    get_connection_count(session, url, site_settings) > 1:
+                segments = split_into_segments(response.content_length, get_segment_count(site_settings))
+
+        if file_extension.lower() in MOVIE_EXTENSIONS or (size or 0) >= LARGE_FILE_SIZE:
             logger.info(f"Starting to download {file_name}")
 
-        pathlib.Path(os.path.dirname(absolute_path)).mkdir(parents=True, exist_ok=True)
-
-        if action == ACTION_REPLACE and site_settings.keep_replaced_files:
-            dir_path = os.path.dirname(absolute_path)
-            pure_name, extension = split_name_extension(file_name)
-            old_file_name = f"{pure_name}-old.{extension}"
-            old_absolute_path = os.path.join(dir_path, old_file_name)
-            os.replace(absolute_path, old_absolute_path)
+        await io_executor.makedirs(os.path.dirname(absolute_path))
 
         try:
-            with open(absolute_path, 'wb') as f:
-                while True:
-                    chunk = await response.content.read(8192)
-                    if not chunk:
-                        break
-                    f.write(chunk)
+            if segments is not None:
+                if mode == "wb":
+                    logger.debug(f"Downloading {file_name} in {len(segments)} segments")
+                    await io_executor.run(preallocate_file, part_path, response.content_length)
+                await download_segments(session=session,
+                                        url=url,
+                                        response=response,
+                                        part_path=part_path,
+                                        segments=segments,
+                                        validator=validator,
+                                        connections=get_connection_count(session, url, site_settings),
+                                        session_kwargs=session_kwargs,
+                                        site_settings=site_settings)
+            else:
+                watchdog = create_watchdog(site_settings)
+                async with io_executor.open_writer(part_path, mode) as f:
+                    await copy_body(response, f, watchdog, get_buffer_size(site_settings))
         except BaseException as e:
-            os.remove(absolute_path)
-            logger.debug(f"Removed file {absolute_path}")
+            if validator is None:
+                await discard_part_file(absolute_path, part_path)
+                logger.debug(f"Removed file {part_path}")
+            else:
+                cache.save_part_info(absolute_path,
+                                     offset=await io_executor.getsize(part_path),
+                                     validator=validator,
+                                     segments=segments)
+                logger.debug(f"Kept partial file {part_path} to resume later")
             raise e
 
+    if action == ACTION_REPLACE and await io_executor.run(filecmp.cmp, part_path, absolute_path, False):
+        # e.g. files extracted from an archive have no etag for a conditional request
+        logger.debug(f"File '{absolute_path}' has the same content")
+        await discard_part_file(absolute_path, part_path)
+        if "ETag" in response_headers:
+            cache.save_etag(absolute_path, response_headers["ETag"])
+        cache.save_checksum(absolute_path, checksum)
+        return
+
+    if action == ACTION_REPLACE and site_settings.keep_replaced_files:
+        dir_path = os.path.dirname(absolute_path)
+        pure_name, extension = split_name_extension(file_name)
+        old_file_name = f"{pure_name}-old.{extension}"
+        old_absolute_path = os.path.join(dir_path, old_file_name)
+        await io_executor.replace(absolute_path, old_absolute_path)
+
+    await io_executor.replace(part_path, absolute_path)
+    cache.remove_part_info(absolute_path)
+
     if site_settings.highlight_difference and \
             action == ACTION_REPLACE and \
             site_settings.keep_replaced_files and \
@@ -177,9 +318,9 @@ async def download_if_not_exist(session,
         )
         try:
             await future
-            os.replace(temp_absolute_path, old_absolute_path)
+            await io_executor.replace(temp_absolute_path, old_absolute_path)
         except asyncio.CancelledError as e:
-            os.replace(old_absolute_path, absolute_path)
+            await io_executor.replace(old_absolute_path, absolute_path)
             logger.debug(f"Reverted old file {absolute_path}")
             raise e
         except Exception as e:
@@ -187,9 +328,8 @@ async def download_if_not_exist(session,
             signal_handler.got_warning(unique_key,
                                        f"Could not add pdf highlight to {absolute_path}. {type(e).__name__}: {e}")
         finally:
-            if os.path.exists(temp_absolute_path):
+            if await io_executor.remove_if_exists(temp_absolute_path):
                 logger.debug(f"Removed temp file {temp_absolute_path}")
-                os.remove(temp_absolute_path)
 
     if "ETag" in response_headers:
         cache.save_etag(absolute_path, response.headers["ETag"])
@@ -199,7 +339,7 @@ async def download_if_not_exist(session,
     cache.save_checksum(absolute_path, checksum)
 
     if action == ACTION_REPLACE:
-        if site_settings.keep_replaced_files and os.path.exists(old_absolute_path):
+        if site_settings.keep_replaced_files and await io_executor.exists(old_absolute_path):
             signal_handler.replaced_file(unique_key, absolute_path, old_absolute_path)
         else:
             signal_handler.replaced_file(unique_key, absolute_path)
@@ -225,3 +365,31 @@ async def download_if_not_exist(session,
     }
 
     logger.info(fit_sections_to_console(start, end, margin=1))
+
+
+async def get_resume_state(absolute_path, part_path):
+    part_info = cache.get_part_info(absolute_path)
+    if part_info is None or not await io_executor.exists(part_path):
+        return 0, None, None
+
+    segments = part_info.get("segments", None)
+    if segments is not None:
+        if not get_pending_ranges(segments):
+            await discard_part_file(absolute_path, part_path)
+            return 0, None, None
+        return 0, part_info["validator"], segments
+
+    offset = await io_executor.getsize(part_path)
+    if offset != part_info["offset"]:
+        logger.debug(f"Partial file {part_path} has {offset} bytes, expected {part_info['offset']}")
+    return offset, part_info["validator"], None
+
+
+def release_response(response):
+    if response is not None:
+        response.release()
+
+
+async def discard_part_file(absolute_path, part_path):
+    await io_executor.remove_if_exists(part_path)
+    cache.remove_part_info(absolute_path)
@@ -12,3 +12,7 @@ class ForbiddenError(Exception):
 
 class ParseTemplateRuntimeError(Exception):
     pass
+
+
+class StallError(Exception):
+    pass
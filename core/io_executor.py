@@ -0,0 +1,115 @@
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = 8
+WRITE_BUFFER_SIZE = 256 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="io_executor")
+
+
+async def run(func, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def exists(path):
+    return await run(os.path.exists, path)
+
+
+async def getsize(path):
+    return await run(os.path.getsize, path)
+
+
+async def listdir(path):
+    return await run(os.listdir, path)
+
+
+async def makedirs(path):
+    return await run(pathlib.Path(path).mkdir, parents=True, exist_ok=True)
+
+
+async def replace(src, dst):
+    return await run(os.replace, src, dst)
+
+
+async def remove(path):
+    return await run(os.remove, path)
+
+
+async def remove_if_exists(path):
+    def _remove_if_exists():
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+
+    return await run(_remove_if_exists)
+
+
+class FileWriter(object):
+    """
+    Collects written data in a buffer and hands full buffers to the io executor.
+    At most one write per file is in flight, which keeps the order of the writes
+    and blocks the writer if the disk can not keep up.
+    """
+
+    def __init__(self, file, buffer_size=WRITE_BUFFER_SIZE):
+        self.file = file
+        self.buffer_size = buffer_size
+        self._buffer = bytearray()
+        self._pending = None
+
+    async def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self.buffer_size:
+            await self._write_behind()
+
+    async def write_through(self, data):
+        """
+        Writes `data` without copying it into the buffer.
+        The caller must not change `data` until the next write or flush returned.
+        """
+        await self._write_behind()
+        await self._wait_pending()
+        self._pending = asyncio.ensure_future(run(self.file.write, data))
+
+    async def seek(self, offset):
+        await self.flush()
+        await run(self.file.seek, offset)
+
+    async def flush(self):
+        await self._write_behind()
+        await self._wait_pending()
+
+    async def _write_behind(self):
+        await self._wait_pending()
+        if not self._buffer:
+            return
+        data, self._buffer = self._buffer, bytearray()
+        self._pending = asyncio.ensure_future(run(self.file.write, data))
+
+    async def _wait_pending(self):
+        if self._pending is None:
+            return
+        await asyncio.shield(self._pending)
+        self._pending = None
+
+
+@contextlib.asynccontextmanager
+async def open_writer(path, mode="wb", buffer_size=WRITE_BUFFER_SIZE):
+    file = await run(open, path, mode)
+    writer = FileWriter(file, buffer_size=buffer_size)
+    try:
+        yield writer
+    finally:
+        try:
+            await writer.flush()
+        finally:
+            await asyncio.shield(run(file.close))
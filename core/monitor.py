@@ -1,25 +1,194 @@
+import asyncio
+import functools
+import time
+
 import aiohttp
+from aiohttp.client import URL
+
+from core import io_executor
+from core.storage import http_cache
+
+ISOLATED_POOL_SIZE = 4
 
 
 class MonitorSession(aiohttp.ClientSession):
-    def __init__(self, signals, *args, **kwargs):
+    def __init__(self, signals, *args, controller=None, rate_limiter=None, http_cache=False, **kwargs):
         super().__init__(*args, **kwargs)
         self.signals = signals
+        self.http_cache = http_cache
+        self.controller = controller
+        if rate_limiter is not None and not rate_limiter.is_active():
+            rate_limiter = None
+        self.rate_limiter = rate_limiter
+        self._isolated_pool = []
+
+    async def _request(self, method, str_or_url, **kwargs):
+        host = URL(str_or_url).host
+        if self.rate_limiter is not None:
+            await self.rate_limiter.limit_request(host)
 
-    async def _request(self, *args, **kwargs):
-        response = await super()._request(*args, **kwargs)
+        start = time.monotonic()
+        try:
+            response = await super()._request(method, str_or_url, **kwargs)
+        except aiohttp.ClientResponseError as e:
+            if self.controller is not None:
+                self.controller.record_response(host, e.status, time.monotonic() - start)
+            raise e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if self.controller is not None:
+                self.controller.record_error(host)
+            raise e
+
+        if self.controller is not None:
+            self.controller.record_response(host, response.status, time.monotonic() - start)
         headers_length = sum((len(key) + len(value) for key, value in response.raw_headers))
-        if self.signals is not None:
-            self.signals.downloaded_content_length.emit(headers_length)
-        response.content.read = async_monitor_length_bytes(response.content.read, signals=self.signals)
+        self.monitor_downloaded(host, headers_length)
+        limit = None
+        if self.rate_limiter is not None:
+            limit = functools.partial(self.rate_limiter.limit_bytes, host)
+        response.content.read = MonitoredRead(response.content.read,
+                                              functools.partial(self.monitor_downloaded, host),
+                                              limit=limit)
         return response
 
+    async def get_page(self, url, parser=None, **kwargs):
+        """
+        Returns the page at `url`. With the http cache enabled, the request is revalidated with the
+        ETag and Last-Modified of the cached page and a 304 returns the cached body with `changed=False`.
+        `parser` is called with the page and its json serializable result is cached as well,
+        so unchanged pages don't need to be parsed again.
+        """
+        entry = None
+        if self.http_cache:
+            entry = http_cache.get_entry(url)
+
+        if entry is not None:
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers.update(http_cache.get_conditional_headers(entry))
+            kwargs["headers"] = headers
+
+        async with self.get(url, **kwargs) as response:
+            if response.status == 304 and entry is not None:
+                try:
+                    body = await io_executor.run(http_cache.load_body, url)
+                except FileNotFoundError:
+                    http_cache.remove_entry(url)
+                    await io_executor.run(http_cache.remove_files, url)
+                    kwargs["headers"] = {key: value for key, value in kwargs["headers"].items()
+                                         if key not in ("If-None-Match", "If-Modified-Since")}
+                    return await self.get_page(url, parser=parser, **kwargs)
+                page = Page(entry["url"], body, entry["encoding"], changed=False)
+            else:
+                body = await response.read()
+                page = Page(str(response.url), body, response.get_encoding(), changed=True)
+                etag = response.headers.get("ETag", None)
+                last_modified = response.headers.get("Last-Modified", None)
+                if self.http_cache and (etag is not None or last_modified is not None):
+                    await io_executor.run(http_cache.save_body, url, body)
+                    http_cache.save_entry(url, page.url, etag, last_modified, page.encoding)
+                elif entry is not None:
+                    http_cache.remove_entry(url)
+                    await io_executor.run(http_cache.remove_files, url)
+
+        if parser is not None:
+            page.parsed = await self._parse_page(url, page, parser)
+        return page
+
+    async def _parse_page(self, url, page, parser):
+        parser_name = f"{parser.__module__}.{parser.__qualname__}"
+        if not page.changed:
+            parsed = await io_executor.run(http_cache.load_parsed, url, parser_name)
+            if parsed is not None:
+                return parsed
+
+        parsed = parser(page)
+        if self.http_cache and http_cache.get_entry(url) is not None:
+            await io_executor.run(http_cache.save_parsed, url, parser_name, parsed)
+        return parsed
+
+    def isolated(self):
+        """
+        Returns a context manager with a session, which has its own cookies but shares the connections
+        of this session. Released sessions are kept with cleared cookies for the next caller.
+        """
+        return IsolatedSession(self)
+
+    def _acquire_isolated(self):
+        if self._isolated_pool:
+            return self._isolated_pool.pop()
+
+        return MonitorSession(self.signals,
+                              connector=self.connector,
+                              connector_owner=False,
+                              raise_for_status=self._raise_for_status,
+                              timeout=self._timeout,
+                              controller=self.controller,
+                              rate_limiter=self.rate_limiter,
+                              http_cache=self.http_cache)
+
+    async def _release_isolated(self, session):
+        session.cookie_jar.clear()
+        if not self.closed and len(self._isolated_pool) < ISOLATED_POOL_SIZE:
+            self._isolated_pool.append(session)
+        else:
+            await session.close()
+
+    async def close(self):
+        while self._isolated_pool:
+            await self._isolated_pool.pop().close()
+        await super().close()
+
+    def monitor_downloaded(self, host, length):
+        if self.signals is not None:
+            self.signals.downloaded_content_length.emit(length)
+        if self.controller is not None:
+            self.controller.record_bytes(host, length)
+
+
+class IsolatedSession(object):
+    def __init__(self, session):
+        self.session = session
+        self._isolated = None
+
+    async def __aenter__(self):
+        self._isolated = self.session._acquire_isolated()
+        return self._isolated
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.session._release_isolated(self._isolated)
+        self._isolated = None
+
+
+class Page(object):
+    def __init__(self, url, body, encoding, changed):
+        self.url = url
+        self.body = body
+        self.encoding = encoding
+        self.changed = changed
+        self.parsed = None
+
+    @property
+    def text(self):
+        return self.body.decode(self.encoding, errors="replace")
+
+
+class MonitoredRead(object):
+    """
+    Wraps a read function and accounts every read chunk.
+    Callers which read a lot can call `func` directly and `account` once per batch.
+    """
+
+    def __init__(self, func, callback, limit=None):
+        self.func = func
+        self.callback = callback
+        self.limit = limit
 
-def async_monitor_length_bytes(func, signals):
-    async def wrapper(*args, **kwargs):
-        result = await func(*args, **kwargs)
-        if signals is not None:
-            signals.downloaded_content_length.emit(len(result))
+    async def __call__(self, *args, **kwargs):
+        result = await self.func(*args, **kwargs)
+        await self.account(len(result))
         return result
 
-    return wrapper
+    async def account(self, length):
+        self.callback(length)
+        if self.limit is not None and length:
+            await self.limit(length)
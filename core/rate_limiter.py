@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+
+class TokenBucket(object):
+    """
+    Token bucket which allows going into debt. A caller which overdraws the bucket
+    sleeps until the debt is paid off, so concurrent callers queue up fairly
+    without a lock.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    async def consume(self, amount=1):
+        self._refill()
+        self.tokens -= amount
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class RateLimiter(object):
+    def __init__(self, bytes_per_second=0, bytes_per_second_per_host=0, requests_per_second_per_host=0):
+        self.bytes_per_second_per_host = bytes_per_second_per_host
+        self.requests_per_second_per_host = requests_per_second_per_host
+        self.global_bytes = TokenBucket(bytes_per_second) if bytes_per_second else None
+        self._host_bytes = {}
+        self._host_requests = {}
+
+    def is_active(self):
+        return bool(self.global_bytes or self.bytes_per_second_per_host or self.requests_per_second_per_host)
+
+    async def limit_request(self, host):
+        if not self.requests_per_second_per_host:
+            return
+
+        if host not in self._host_requests:
+            self._host_requests[host] = TokenBucket(self.requests_per_second_per_host,
+                                                    capacity=max(1, self.requests_per_second_per_host))
+        await self._host_requests[host].consume(1)
+
+    async def limit_bytes(self, host, length):
+        if self.bytes_per_second_per_host:
+            if host not in self._host_bytes:
+                self._host_bytes[host] = TokenBucket(self.bytes_per_second_per_host)
+            await self._host_bytes[host].consume(length)
+
+        if self.global_bytes is not None:
+            await self.global_bytes.consume(length)
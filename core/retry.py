@@ -0,0 +1,46 @@
+import asyncio
+import email.utils
+import random
+import time
+
+import aiohttp
+
+from core.exceptions import StallError
+
+TRANSIENT_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 5
+BASE_DELAY = 2
+MAX_DELAY = 120
+MAX_RETRY_AFTER = 600
+
+
+def is_transient(exception):
+    if isinstance(exception, aiohttp.ClientResponseError):
+        return exception.status in TRANSIENT_STATUSES
+    return isinstance(exception, (aiohttp.ClientConnectionError,
+                                  aiohttp.ClientPayloadError,
+                                  asyncio.TimeoutError,
+                                  StallError))
+
+
+def get_retry_after(exception):
+    headers = getattr(exception, "headers", None)
+    if not headers or "Retry-After" not in headers:
+        return None
+
+    value = headers["Retry-After"].strip()
+    if value.isdigit():
+        return int(value)
+
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, date.timestamp() - time.time())
+
+
+def get_retry_delay(attempt, retry_after=None):
+    delay = random.uniform(BASE_DELAY / 2, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, MAX_RETRY_AFTER))
+    return delay
@@ -0,0 +1,150 @@
+import asyncio
+import collections
+import logging
+
+import aiohttp
+from aiohttp.client import URL
+
+from core import io_executor
+from core.stall_watchdog import create_download_timeout, create_watchdog
+from core.utils import get_content_range_start
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 8192
+SEGMENT_CONNECT_TIMEOUT = 60
+
+
+def use_segments(response, site_settings):
+    threshold = site_settings.segmented_download_threshold * 1024 * 1024
+    if not threshold or site_settings.segmented_download_segments < 2:
+        return False
+
+    if response.headers.get("Accept-Ranges", "").lower() != "bytes":
+        return False
+
+    if "Content-Encoding" in response.headers:
+        return False
+
+    if response.content_length is None or response.content_length < threshold:
+        return False
+
+    return True
+
+
+def get_segment_count(site_settings):
+    count = site_settings.segmented_download_segments
+    if site_settings.conn_limit_per_host:
+        count = min(count, site_settings.conn_limit_per_host)
+    return max(count, 1)
+
+
+def get_connection_count(session, url, site_settings):
+    """
+    Returns how many connections a segmented download of `url` may use: the already open one
+    plus the free connections of the pool for its host, so segments never wait for each other.
+    """
+    count = get_segment_count(site_settings)
+    free = get_free_connections(session.connector, URL(url).host)
+    if free is None:
+        return count
+    return min(count, 1 + free)
+
+
+def get_free_connections(connector, host):
+    """Returns the free connections of the pool for `host`, None if unlimited"""
+    acquired = getattr(connector, "_acquired", None)
+    acquired_per_host = getattr(connector, "_acquired_per_host", None)
+    if acquired is None or acquired_per_host is None:
+        return 0
+
+    free = []
+    if connector.limit:
+        free.append(connector.limit - len(acquired))
+    if connector.limit_per_host:
+        host_acquired = sum(len(connections) for key, connections in acquired_per_host.items() if key.host == host)
+        free.append(connector.limit_per_host - host_acquired)
+    if not free:
+        return None
+    return max(0, min(free))
+
+
+def split_into_segments(size, count):
+    segment_size = -(-size // count)
+    return [[start, min(start + segment_size, size) - 1, 0] for start in range(0, size, segment_size)]
+
+
+def get_pending_ranges(segments):
+    return [(start + done, end) for start, end, done in segments if start + done <= end]
+
+
+def preallocate_file(path, size):
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+async def download_segments(session, url, response, part_path, segments, validator, connections, session_kwargs,
+                            site_settings):
+    """
+    Downloads all unfinished segments with at most `connections` concurrent requests into the
+    preallocated part file. The already open response serves the first unfinished segment and is
+    closed afterwards, so its connection is free for the other segments.
+    The progress is saved in place in `segments`, so an interrupted download can be resumed.
+    """
+    pending = [segment for segment in segments if segment[0] + segment[2] <= segment[1]]
+    remaining = collections.deque(pending[1:])
+    timeout = create_download_timeout(site_settings, connect=SEGMENT_CONNECT_TIMEOUT)
+
+    async def fetch_remaining():
+        while remaining:
+            segment = remaining.popleft()
+            await _fetch_segment(session, url, part_path, segment, validator, timeout, session_kwargs, site_settings)
+
+    async def read_first():
+        try:
+            await _read_segment(response, part_path, pending[0], site_settings)
+        finally:
+            response.close()
+        await fetch_remaining()
+
+    tasks = [asyncio.ensure_future(read_first())]
+    for _ in range(max(1, connections) - 1):
+        tasks.append(asyncio.ensure_future(fetch_remaining()))
+
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException as e:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise e
+
+
+async def _fetch_segment(session, url, part_path, segment, validator, timeout, session_kwargs, site_settings):
+    start, end, done = segment
+    headers = dict(session_kwargs.get("headers", {}))
+    headers["Range"] = f"bytes={start + done}-{end}"
+    headers["If-Range"] = validator
+    request_kwargs = dict(session_kwargs)
+    request_kwargs["headers"] = headers
+
+    async with session.get(url, timeout=timeout, **request_kwargs) as response:
+        if response.status != 206 or get_content_range_start(response.headers) != start + done:
+            raise ValueError(f"File {url} changed during the segmented download")
+
+        await _read_segment(response, part_path, segment, site_settings)
+
+
+async def _read_segment(response, part_path, segment, site_settings):
+    start, end, done = segment
+    remaining = end + 1 - (start + done)
+    watchdog = create_watchdog(site_settings)
+    async with io_executor.open_writer(part_path, "r+b") as f:
+        await f.seek(start + done)
+        while remaining > 0:
+            chunk = await watchdog.read(response.content.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise aiohttp.ClientPayloadError(f"Connection closed with {remaining} bytes left in segment")
+            await f.write(chunk)
+            segment[2] += len(chunk)
+            remaining -= len(chunk)
@@ -0,0 +1,26 @@
+import asyncio
+
+
+class SingleFlight(object):
+    """
+    Runs at most one call per key at a time.
+    Concurrent callers with the same key await the result of the running call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def run(self, key, func, *args, **kwargs):
+        future = self._calls.get(key, None)
+        if future is None:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._remove(key, future))
+        return await asyncio.shield(future)
+
+    def _remove(self, key, future):
+        if self._calls.get(key, None) is future:
+            del self._calls[key]
+
+    def __contains__(self, key):
+        return key in self._calls
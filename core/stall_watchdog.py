@@ -0,0 +1,87 @@
+import asyncio
+import collections
+import time
+
+import aiohttp
+
+from core.exceptions import StallError
+from core.monitor import MonitoredRead
+
+THROUGHPUT_WINDOW = 60
+SOCK_CONNECT_TIMEOUT = 30
+
+
+def create_watchdog(site_settings):
+    return StallWatchdog(idle_timeout=site_settings.stall_timeout,
+                         min_speed=site_settings.stall_min_speed * 1024)
+
+
+def create_download_timeout(site_settings, connect=None):
+    """
+    Downloads have no total timeout, but connecting and waiting for the response headers are bounded.
+    `connect` additionally bounds the wait for a free connection of the pool.
+    """
+    return aiohttp.ClientTimeout(total=0,
+                                 connect=connect,
+                                 sock_connect=SOCK_CONNECT_TIMEOUT,
+                                 sock_read=site_settings.stall_timeout or None)
+
+
+class StallWatchdog(object):
+    """
+    Aborts a transfer with a StallError if no data arrives for `idle_timeout` seconds
+    or if less than `min_speed` bytes per second arrived during the last `window` seconds.
+    The time spent waiting for our own rate limiter is not measured.
+    """
+
+    def __init__(self, idle_timeout, min_speed, window=THROUGHPUT_WINDOW):
+        self.idle_timeout = idle_timeout or None
+        self.min_speed = min_speed
+        self.window = window
+        self.excluded = 0
+        self.start = self.clock()
+        self._samples = collections.deque()
+        self._window_bytes = 0
+
+    def clock(self):
+        return time.monotonic() - self.excluded
+
+    async def read(self, read_func, size):
+        account = None
+        if isinstance(read_func, MonitoredRead):
+            read_func, account = read_func.func, read_func.account
+
+        try:
+            chunk = await asyncio.wait_for(read_func(size), self.idle_timeout)
+        except asyncio.TimeoutError:
+            raise StallError(f"Received no data for {self.idle_timeout} seconds")
+
+        if account is not None:
+            await self.account(account, len(chunk))
+        self.record(len(chunk))
+        return chunk
+
+    async def account(self, account, length):
+        """Calls `account`, which may wait for the rate limiter, without measuring the time"""
+        start = time.monotonic()
+        await account(length)
+        self.excluded += time.monotonic() - start
+
+    def record(self, length):
+        if not self.min_speed:
+            return
+
+        now = self.clock()
+        self._samples.append((now, length))
+        self._window_bytes += length
+        while self._samples[0][0] < now - self.window:
+            _, old_length = self._samples.popleft()
+            self._window_bytes -= old_length
+
+        if now - self.start < self.window:
+            return
+
+        speed = self._window_bytes / self.window
+        if speed < self.min_speed:
+            raise StallError(f"Download speed of {speed / 1024:.1f} KB/s over the last {self.window} seconds "
+                             f"is below the minimum of {self.min_speed / 1024:.1f} KB/s")
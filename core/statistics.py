@@ -0,0 +1,21 @@
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RunStatistics(object):
+    def __init__(self):
+        self.counters = collections.Counter()
+
+    def record(self, name, count=1):
+        self.counters[name] += count
+
+    def __getitem__(self, name):
+        return self.counters[name]
+
+    def log_summary(self):
+        if not self.counters:
+            return
+        summary = ", ".join(f"{name}: {count}" for name, count in sorted(self.counters.items()))
+        logger.info(f"Run statistics: {summary}")
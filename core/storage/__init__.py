@@ -1,5 +1,6 @@
 import atexit
 
-from core.storage import cache
+from core.storage import cache, meta_data
 
 atexit.register(cache.save_jsons)
+atexit.register(meta_data.close_store)
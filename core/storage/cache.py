@@ -1,13 +1,75 @@
+import asyncio
+import collections
 import json
 import logging
 import os
+import threading
+import time
 
+from core import io_executor
+from core.single_flight import SingleFlight
+from core.storage import meta_data
 from core.storage.constants import JSON_CACHE_PATH
 from core.utils import get_extension_from_response
 
 logger = logging.getLogger(__name__)
 
 loaded_jsons = {}
+max_unflushed_changes = 0
+_unflushed_changes = 0
+_flush_lock = threading.RLock()
+_flush_requested = None
+_flush_loop = None
+
+
+class TrackedDict(dict):
+    """Dict which counts the changes to its keys, so only changed tables are written"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changes = 0
+
+    def mark_changed(self):
+        global _unflushed_changes
+        self.changes += 1
+        _unflushed_changes += 1
+        if max_unflushed_changes and _unflushed_changes >= max_unflushed_changes:
+            request_flush()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.mark_changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.mark_changed()
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self.mark_changed()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self.mark_changed()
+        return result
+
+    def move_to_end(self, key):
+        """Marks `key` as recently used. Only the order changes, so this is not counted as a change"""
+        dict.__setitem__(self, key, dict.pop(self, key))
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.mark_changed()
+
+    def clear(self):
+        super().clear()
+        self.mark_changed()
 
 
 def get_json(name):
@@ -16,9 +78,14 @@ def get_json(name):
     return loaded_jsons[name]["value"]
 
 
+def mark_changed(name):
+    """Has to be called after changing a nested value of a table"""
+    get_json(name).mark_changed()
+
+
 def set_json(name, value, path):
     item = {
-        "value": value,
+        "value": TrackedDict(value),
         "meta": {
             "path": path,
         },
@@ -37,60 +104,235 @@ def load_json(name):
 
 
 def save_json(path, value):
-    with open(path, "w+") as f:
-        json.dump(value, f)
+    write_json(path, json.dumps(value))
+
+
+def write_json(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w+") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def serialize_changed_jsons():
+    global _unflushed_changes
+    result = []
+    with _flush_lock:
+        for name, item in list(loaded_jsons.items()):
+            value = item["value"]
+            if not value.changes:
+                continue
+            logger.debug(f"Flushing {name} json")
+            value.changes = 0
+            result.append((item["meta"]["path"], json.dumps(value)))
+        _unflushed_changes = 0
+    return result
+
+
+def write_jsons(serialized_jsons):
+    with _flush_lock:
+        for path, data in serialized_jsons:
+            write_json(path, data)
+
+
+def flush_jsons():
+    """Writes every table which changed since the last flush and the pending file meta data"""
+    write_jsons(serialize_changed_jsons())
+    meta_data.flush_store()
+
+
+def request_flush():
+    """Wakes up the running flusher, so it doesn't wait for the end of its interval"""
+    if _flush_requested is not None and not _flush_requested.is_set():
+        _flush_loop.call_soon_threadsafe(_flush_requested.set)
+
+
+async def flush_jsons_periodically(interval, max_changes=0):
+    """
+    Flushes the changed tables and the file meta data every `interval` seconds
+    and as soon as `max_changes` changes are unflushed.
+    The tables are serialized on the event loop, so they don't change meanwhile, and written in the io executor.
+    """
+    global max_unflushed_changes, _flush_requested, _flush_loop
+    if not interval and not max_changes:
+        return
+
+    max_unflushed_changes = max_changes
+    _flush_requested = asyncio.Event()
+    _flush_loop = asyncio.get_event_loop()
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(_flush_requested.wait(), interval or None)
+            except asyncio.TimeoutError:
+                pass
+            _flush_requested.clear()
+            await io_executor.run(write_jsons, serialize_changed_jsons())
+            await io_executor.run(meta_data.flush_store)
+    finally:
+        max_unflushed_changes = 0
+        _flush_requested = None
+        _flush_loop = None
 
 
 def save_jsons():
     logger.debug("Cleaning up lockup table")
-    for name, item in loaded_jsons.items():
-        path = item["meta"]["path"]
-        save_json(path, item["value"])
+    flush_jsons()
     loaded_jsons.clear()
 
 
 def get_file_meta_data(path):
-    table = get_json("file_meta_data")
-    if path not in table:
-        table[path] = {}
-    return table[path]
+    return meta_data.get_store().get(path)
+
+
+def update_file_meta_data(path, **fields):
+    meta_data.get_store().update(path, **fields)
+
+
+class CachePolicy(object):
+    """
+    Limits a table to `max_entries` entries with LRU eviction.
+    Entries expire after `ttl` seconds, negative entries (e.g. failed lookups) after `negative_ttl` seconds.
+    0 disables a limit.
+    """
+
+    def __init__(self, max_entries=0, ttl=0, negative_ttl=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def get_expires(self, negative=False):
+        ttl = self.negative_ttl if negative else self.ttl
+        if not ttl:
+            return None
+        return time.time() + ttl
+
+
+DAY = 24 * 60 * 60
+
+POLICIES = {
+    "url_reference": CachePolicy(max_entries=20000, ttl=30 * DAY),
+    "extensions": CachePolicy(max_entries=20000, ttl=90 * DAY, negative_ttl=DAY),
+}
+
+cache_statistics = collections.defaultdict(collections.Counter)
+in_flight = SingleFlight()
+_trimmed_tables = set()
+
+
+def get_policy_table(name):
+    table = get_json(name)
+    if name not in _trimmed_tables:
+        _trimmed_tables.add(name)
+        _evict(table, POLICIES[name])
+    return table
+
+
+def get_cached(name, key):
+    table = get_policy_table(name)
+    entry = table.get(key, None)
+    if entry is None:
+        cache_statistics[name]["misses"] += 1
+        return None
+
+    if not isinstance(entry, list):
+        # Entry from before the tables had policies
+        entry = [entry, POLICIES[name].get_expires()]
+        table[key] = entry
+
+    value, expires = entry
+    if expires is not None and expires < time.time():
+        cache_statistics[name]["expired"] += 1
+        del table[key]
+        return None
+
+    cache_statistics[name]["hits"] += 1
+    table.move_to_end(key)
+    return value
+
+
+def set_cached(name, key, value, negative=False):
+    table = get_policy_table(name)
+    policy = POLICIES[name]
+    table.pop(key, None)
+    table[key] = [value, policy.get_expires(negative)]
+    _evict(table, policy)
+
+
+def _evict(table, policy):
+    if not policy.max_entries:
+        return
+    while len(table) > policy.max_entries:
+        del table[next(iter(table))]
+
+
+def log_statistics():
+    for name, counter in cache_statistics.items():
+        requests = counter["hits"] + counter["misses"] + counter["expired"]
+        if not requests:
+            continue
+        logger.debug(f"Cache {name}: {counter['hits']} hits, {counter['misses']} misses, "
+                     f"{counter['expired']} expired, hit rate {counter['hits'] / requests:.0%}")
 
 
 async def check_url_reference(session, url):
-    table = get_json("url_reference")
-    new_url = table.get(url, None)
+    new_url = get_cached("url_reference", url)
 
     if new_url is None:
-        async with session.get(url, raise_for_status=False) as response:
-            new_url = str(response.url)
-        table[url] = new_url
-        logger.debug(f"Called url_reference, url: {url}, new url: {new_url}")
+        new_url = await in_flight.run(("url_reference", url), _fetch_url_reference, session, url)
+
+    return new_url
 
+
+async def _fetch_url_reference(session, url):
+    async with session.get(url, raise_for_status=False) as response:
+        new_url = str(response.url)
+    set_cached("url_reference", url, new_url)
+    logger.debug(f"Called url_reference, url: {url}, new url: {new_url}")
     return new_url
 
 
+EXTENSION_ERROR = "error"
+
+
+def get_cached_extension(url):
+    return get_cached("extensions", url)
+
+
+def save_extension(url, extension):
+    if extension is None:
+        set_cached("extensions", url, EXTENSION_ERROR, negative=True)
+    else:
+        set_cached("extensions", url, extension)
+
+
 async def check_extension(session, url, session_kwargs=None):
     if session_kwargs is None:
         session_kwargs = {}
 
-    table = get_json("extensions")
-    extension = table.get(url, None)
+    extension = get_cached_extension(url)
+
+    if extension is None:
+        extension = await in_flight.run(("extensions", url), _fetch_extension, session, url, session_kwargs)
 
-    if extension == "error":
+    if extension == EXTENSION_ERROR:
         return None
 
-    if extension is None:
-        async with session.get(url, raise_for_status=True, **session_kwargs) as response:
-            extension = get_extension_from_response(response)
+    return extension
 
-        if extension is None:
-            table[url] = "error"
-            logger.warning(f"Could not retrieve from {url}. {response.status}")
-            return None
 
-        table[url] = extension
-        logger.debug(f"Called extension_cache, url: {url}, extension: {extension}")
+async def _fetch_extension(session, url, session_kwargs):
+    async with session.get(url, raise_for_status=True, **session_kwargs) as response:
+        extension = get_extension_from_response(response)
 
+    save_extension(url, extension)
+    if extension is None:
+        logger.warning(f"Could not retrieve from {url}. {response.status}")
+        return EXTENSION_ERROR
+
+    logger.debug(f"Called extension_cache, url: {url}, extension: {extension}")
     return extension
 
 
@@ -98,9 +340,7 @@ def is_checksum_same(path, checksum):
     if checksum is None:
         return True
 
-    meta_data = get_file_meta_data(path)
-
-    old_checksum = meta_data.get("checksum", None)
+    old_checksum = get_file_meta_data(path).get("checksum", None)
 
     if old_checksum is None:
         return False
@@ -115,9 +355,7 @@ def save_checksum(path, checksum):
     if checksum is None:
         return
 
-    meta_data = get_file_meta_data(path)
-
-    old_checksum = meta_data.get("checksum", None)
+    old_checksum = get_file_meta_data(path).get("checksum", None)
 
     if old_checksum == checksum:
         return
@@ -127,20 +365,81 @@ def save_checksum(path, checksum):
     else:
         logger.debug(f"Replaced old checksum, path: {path}, new: {checksum}, old: {old_checksum}")
 
-    meta_data["checksum"] = checksum
+    update_file_meta_data(path, checksum=checksum)
 
 
 def get_etag(path):
-    meta_data = get_file_meta_data(path)
-    return meta_data.get("etag", None)
+    return get_file_meta_data(path).get("etag", None)
 
 
 def save_etag(path, etag):
     etag = etag.replace("-gzip", "")
-    meta_data = get_file_meta_data(path)
-    if "etag" in meta_data:
-        logger.debug(f"Replacing etag. Old: {meta_data['etag']}, New: {etag}")
+    old_etag = get_etag(path)
+    if old_etag is not None:
+        logger.debug(f"Replacing etag. Old: {old_etag}, New: {etag}")
     else:
         logger.debug(f"Adding new etag. New: {etag}")
 
-    meta_data["etag"] = etag
+    update_file_meta_data(path, etag=etag)
+
+
+def get_part_info(path):
+    return get_file_meta_data(path).get("part", None)
+
+
+def save_part_info(path, offset, validator, segments=None):
+    part = {
+        "offset": offset,
+        "validator": validator,
+    }
+    if segments is not None:
+        part["segments"] = segments
+    update_file_meta_data(path, part=part)
+
+
+def remove_part_info(path):
+    if get_part_info(path) is not None:
+        update_file_meta_data(path, part=None)
+
+
+DEAD_LETTER_MAX_AGE = 30 * DAY
+
+
+def get_dead_letters():
+    return get_json("dead_letter")
+
+
+def add_dead_letter(path, url, error, attempts, unique_key=None):
+    table = get_json("dead_letter")
+    table[path] = {
+        "url": str(url),
+        "error": error,
+        "attempts": attempts,
+        "time": time.time(),
+        "unique_key": unique_key,
+    }
+
+
+def prune_dead_letters(completed_keys, since):
+    """
+    Removes the dead letters of the completed producers which failed before `since` and weren't
+    downloaded again since. Their producer didn't queue them anymore, so they would stay forever.
+    Dead letters without a producer are kept until they are older than DEAD_LETTER_MAX_AGE.
+    """
+    table = get_json("dead_letter")
+    for path, dead_letter in list(table.items()):
+        if dead_letter["time"] >= since:
+            continue
+
+        unique_key = dead_letter.get("unique_key", None)
+        if unique_key in completed_keys or \
+                (unique_key is None and dead_letter["time"] < since - DEAD_LETTER_MAX_AGE):
+            logger.debug(f"Removed stale dead letter, path: {path}")
+            del table[path]
+
+
+def remove_dead_letter(path):
+    table = get_json("dead_letter")
+    if path in table:
+        logger.debug(f"Removed dead letter, path: {path}")
+        del table[path]
@@ -11,3 +11,11 @@ Path(JSON_CACHE_PATH).mkdir(parents=True, exist_ok=True)
 
 FUNCTION_CACHE_PATH = os.path.join(CACHE_PATH, "function_results")
 Path(FUNCTION_CACHE_PATH).mkdir(parents=True, exist_ok=True)
+
+META_DATA_DATABASE_PATH = os.path.join(CACHE_PATH, "meta_data.sqlite")
+
+HTTP_CACHE_PATH = os.path.join(CACHE_PATH, "http")
+Path(HTTP_CACHE_PATH).mkdir(parents=True, exist_ok=True)
+
+ARCHIVE_TEMP_PATH = os.path.join(CACHE_PATH, "archives")
+Path(ARCHIVE_TEMP_PATH).mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import logging
+import os
+import zlib
+
+from core.storage import cache
+from core.storage.constants import HTTP_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "http_cache"
+
+
+def get_key(url):
+    return hashlib.sha256(str(url).encode("utf-8")).hexdigest()
+
+
+def get_entry(url):
+    return cache.get_json(INDEX_NAME).get(get_key(url), None)
+
+
+def get_conditional_headers(entry):
+    headers = {}
+    if entry.get("etag", None) is not None:
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified", None) is not None:
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+# The index is a tracked cache table and may only be changed on the event loop.
+# The functions which access files are meant to be run in the io executor.
+
+def save_entry(url, final_url, etag, last_modified, encoding):
+    cache.get_json(INDEX_NAME)[get_key(url)] = {
+        "url": final_url,
+        "etag": etag,
+        "last_modified": last_modified,
+        "encoding": encoding,
+    }
+
+
+def remove_entry(url):
+    cache.get_json(INDEX_NAME).pop(get_key(url), None)
+
+
+def save_body(url, body):
+    key = get_key(url)
+    _write(_get_path(key, "body"), body)
+    _remove(_get_path(key, "parsed"))
+
+
+def remove_files(url):
+    key = get_key(url)
+    _remove(_get_path(key, "body"))
+    _remove(_get_path(key, "parsed"))
+
+
+def load_body(url):
+    return _read(_get_path(get_key(url), "body"))
+
+
+def load_parsed(url, parser_name):
+    try:
+        parsed = json.loads(_read(_get_path(get_key(url), "parsed")))
+    except FileNotFoundError:
+        return None
+    return parsed.get(parser_name, None)
+
+
+def save_parsed(url, parser_name, result):
+    path = _get_path(get_key(url), "parsed")
+    try:
+        parsed = json.loads(_read(path))
+    except FileNotFoundError:
+        parsed = {}
+    parsed[parser_name] = result
+    _write(path, json.dumps(parsed).encode("utf-8"))
+
+
+def _get_path(key, kind):
+    return os.path.join(HTTP_CACHE_PATH, f"{key}.{kind}")
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return zlib.decompress(f.read())
+
+
+def _write(path, data):
+    with open(path + ".tmp", "wb") as f:
+        f.write(zlib.compress(data))
+    os.replace(path + ".tmp", path)
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from core.storage.constants import JSON_CACHE_PATH, META_DATA_DATABASE_PATH
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+MAX_PENDING_AGE = 10
+FIELDS = ["etag", "checksum", "part"]
+JSON_FIELDS = {"part"}
+
+
+class MetaDataStore(object):
+    """
+    Stores the etag, checksum and partial download state of every downloaded file in SQLite.
+    Lookups are indexed by the path. Changes are kept in memory and written in one transaction
+    once `batch_size` files changed, the oldest change is `max_age` seconds old or `flush` is called.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE, max_age=MAX_PENDING_AGE):
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_since = None
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS file_meta_data ("
+                                 "path TEXT PRIMARY KEY, etag TEXT, checksum TEXT, part TEXT)")
+        self._connection.commit()
+
+    def get(self, path):
+        with self._lock:
+            if path in self._pending:
+                return dict(self._pending[path])
+            return self._load(path)
+
+    def update(self, path, **fields):
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            if path not in self._pending:
+                self._pending[path] = self._load(path)
+            self._pending[path].update(fields)
+            if len(self._pending) >= self.batch_size or time.monotonic() - self._pending_since >= self.max_age:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._connection.close()
+
+    def is_empty(self):
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM file_meta_data LIMIT 1").fetchone() is None
+
+    def insert_many(self, items):
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO file_meta_data VALUES (?, ?, ?, ?)",
+                                         (self._to_row(path, meta_data) for path, meta_data in items))
+
+    def _load(self, path):
+        row = self._connection.execute("SELECT etag, checksum, part FROM file_meta_data WHERE path = ?",
+                                       (path,)).fetchone()
+        if row is None:
+            return {}
+
+        meta_data = {}
+        for field, value in zip(FIELDS, row):
+            if value is None:
+                continue
+            meta_data[field] = json.loads(value) if field in JSON_FIELDS else value
+        return meta_data
+
+    def _flush(self):
+        if not self._pending:
+            return
+
+        logger.debug(f"Writing meta data of {len(self._pending)} files")
+        with self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO file_meta_data VALUES (?, ?, ?, ?)",
+                                         (self._to_row(path, meta_data)
+                                          for path, meta_data in self._pending.items()))
+        self._pending.clear()
+
+    @staticmethod
+    def _to_row(path, meta_data):
+        values = []
+        for field in FIELDS:
+            value = meta_data.get(field, None)
+            if value is not None and field in JSON_FIELDS:
+                value = json.dumps(value)
+            values.append(value)
+        return (path, *values)
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = MetaDataStore(META_DATA_DATABASE_PATH)
+        migrate_json(_store)
+    return _store
+
+
+def flush_store():
+    if _store is not None:
+        _store.flush()
+
+
+def close_store():
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
+
+def migrate_json(store):
+    json_path = os.path.join(JSON_CACHE_PATH, "file_meta_data.json")
+    if not os.path.exists(json_path):
+        return
+
+    if store.is_empty():
+        logger.info("Migrating file_meta_data.json to the meta data database")
+        with open(json_path, "r") as f:
+            table = json.load(f)
+        store.insert_many(table.items())
+
+    os.replace(json_path, json_path + ".migrated")
@@ -1,75 +1,158 @@
-import copy
+import asyncio
+import hashlib
 import json
 import logging
 import os
-import pickle
-import random
+import time
+import zlib
 
+import aiohttp
+from aiohttp.client import URL
+
+from core import io_executor
 from core.storage import cache
 from core.storage.constants import FUNCTION_CACHE_PATH
 
 logger = logging.getLogger(__name__)
 
+INDEX_NAME = "function_cache"
+PAYLOAD_EXTENSION = "zlib"
+MAX_CACHE_SIZE = 200 * 1024 * 1024
+FORMAT_TEXT = "text"
+FORMAT_BYTES = "bytes"
+FORMAT_JSON = "json"
 
-def is_jsonable(x):
-    try:
-        json.dumps(x)
-        return True
-    except (TypeError, OverflowError):
-        return False
+_garbage_collection = None
 
 
 async def call_function_or_cache(func, identifier, *args, **kwargs):
-    json_name = func.__module__ + "." + func.__name__
-    table = cache.get_json(json_name)
+    """
+    Returns the result of `func(*args, **kwargs)`.
+    The result is cached until the call is made with another `identifier`.
+    Results have to be str, bytes or json serializable. They are stored compressed.
+    Callers should return raw payloads (e.g. html) and parse them themselves.
+    """
+    global _garbage_collection
+    if _garbage_collection is None or _garbage_collection.cancelled():
+        _garbage_collection = asyncio.ensure_future(collect_garbage())
+    if not _garbage_collection.done():
+        await asyncio.shield(_garbage_collection)
+
+    function_name = func.__module__ + "." + func.__name__
+    key = get_func_identifier(function_name, args, kwargs)
+    index = cache.get_json(INDEX_NAME)
+
+    attributes = index.get(key, None)
+    if identifier is not None and attributes is not None and attributes["identifier"] == identifier:
+        try:
+            result = await io_executor.run(load_payload, key, attributes["format"])
+            attributes["used"] = time.time()
+            index.mark_changed()
+            return result
+        except FileNotFoundError:
+            logger.warning(f"Cached result of {function_name} could not be found")
+
+    return await cache.in_flight.run((key, identifier), _call_and_store, func, identifier, key, *args, **kwargs)
+
+
+def reset_garbage_collection():
+    """Has to be called at the start of a run, so that the run collects the garbage again"""
+    global _garbage_collection
+    _garbage_collection = None
+
+
+async def _call_and_store(func, identifier, key, *args, **kwargs):
+    result = await func(*args, **kwargs)
 
-    func_identifier = get_func_identifier(args, kwargs)
-    attributes = table.get(func_identifier, {})
-    cache_identifier = copy.copy(attributes.get("identifier", None))
-    try:
-        if identifier is not None and identifier == cache_identifier:
-            if attributes["pickle"]:
-                with open(attributes["value"], "rb") as f:
-                    return pickle.load(f)
+    if identifier is not None:
+        logger.debug(f"Called function: {func.__module__}.{func.__name__}, key: {key}")
+
+    payload_format, size = await io_executor.run(save_payload, key, result)
+    cache.get_json(INDEX_NAME)[key] = {
+        "function": func.__module__ + "." + func.__name__,
+        "identifier": identifier,
+        "format": payload_format,
+        "size": size,
+        "used": time.time(),
+    }
+    return result
 
-            return attributes["value"]
-    except FileNotFoundError:
-        logger.warning("Pickle file could not be found")
-        pass
 
-    result = await func(*args, **kwargs)
+def get_payload_path(key):
+    return os.path.join(FUNCTION_CACHE_PATH, f"{key}.{PAYLOAD_EXTENSION}")
 
-    if identifier is not None:
-        logger.debug(f"Called function: {json_name}, func_identifier: {func_identifier}")
-    attributes["identifier"] = identifier
 
-    if is_jsonable(result):
-        attributes["value"] = result
-        attributes["pickle"] = False
+def save_payload(key, result):
+    if isinstance(result, str):
+        payload_format, data = FORMAT_TEXT, result.encode("utf-8")
+    elif isinstance(result, bytes):
+        payload_format, data = FORMAT_BYTES, result
     else:
-        file_name = str(random.randint(1e18, 1e19)) + ".pickle"
-        path = os.path.join(FUNCTION_CACHE_PATH, file_name)
-        attributes["value"] = path
-        attributes["pickle"] = True
+        payload_format, data = FORMAT_JSON, json.dumps(result).encode("utf-8")
+
+    data = zlib.compress(data)
+    path = get_payload_path(key)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+    return payload_format, len(data)
+
+
+def load_payload(key, payload_format):
+    with open(get_payload_path(key), "rb") as f:
+        data = zlib.decompress(f.read())
+
+    if payload_format == FORMAT_TEXT:
+        return data.decode("utf-8")
+    if payload_format == FORMAT_JSON:
+        return json.loads(data)
+    return data
+
+
+async def collect_garbage(max_size=MAX_CACHE_SIZE):
+    """
+    Removes the least recently used entries above `max_size` bytes and payloads without an index entry.
+    The index is changed on the event loop, only the files are removed in the io executor.
+    Every caller waits for the collection, so no payload is written meanwhile.
+    """
+    index = cache.get_json(INDEX_NAME)
+    total_size = sum(attributes["size"] for attributes in index.values())
+    for key, attributes in sorted(index.items(), key=lambda item: item[1]["used"]):
+        if total_size <= max_size:
+            break
+        total_size -= attributes["size"]
+        index.pop(key)
 
-        with open(path, "wb+") as f:
-            pickle.dump(result, f)
+    try:
+        await io_executor.run(remove_payloads, set(index.keys()))
+    except OSError as e:
+        logger.warning(f"Could not clean up the function cache. {type(e).__name__}: {e}")
 
-    table[func_identifier] = attributes
-    return result
 
+def remove_payloads(keep_keys):
+    for file_name in os.listdir(FUNCTION_CACHE_PATH):
+        key, _, extension = file_name.partition(".")
+        if extension != PAYLOAD_EXTENSION or key not in keep_keys:
+            logger.debug(f"Removing function cache file {file_name}")
+            os.remove(os.path.join(FUNCTION_CACHE_PATH, file_name))
 
-def get_func_identifier(args, kwargs):
-    result = ""
-    for item in args:
-        result += item_to_string(item)
-    for key, item in kwargs.items():
-        result += str(key) + ":" + item_to_string(item)
 
-    return result
+def get_func_identifier(function_name, args, kwargs):
+    normalized = [function_name,
+                  [normalize_argument(item) for item in args if not isinstance(item, aiohttp.ClientSession)],
+                  {key: normalize_argument(item) for key, item in kwargs.items()
+                   if not isinstance(item, aiohttp.ClientSession)}]
+    data = json.dumps(normalized, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
 
 
-def item_to_string(item):
-    if isinstance(item, (str, int)):
+def normalize_argument(item):
+    if item is None or isinstance(item, (str, int, float, bool)):
+        return item
+    if isinstance(item, URL):
         return str(item)
-    return ""
+    if isinstance(item, (list, tuple)):
+        return [normalize_argument(x) for x in item]
+    if isinstance(item, dict):
+        return {str(key): normalize_argument(value) for key, value in item.items()}
+    raise TypeError(f"Arguments of type {type(item).__name__} can not be used as a cache key")
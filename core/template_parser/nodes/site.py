@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import importlib
 import logging
 import os
@@ -7,13 +8,15 @@ import time
 
 from PyQt5.QtGui import *
 
+from core import io_executor
+from core.downloader import is_extension_forbidden
 from core.exceptions import ParseTemplateError, ParseTemplateRuntimeError
 from core.storage import cache
 from core.template_parser.nodes import site_configs
 from core.template_parser.nodes.base import TemplateNode
 from core.template_parser.queue_wrapper import QueueWrapper
 from core.template_parser.utils import get_module_function, check_if_null, dict_to_string, safe_login_module
-from core.utils import safe_path_join
+from core.utils import safe_path_join, get_extension
 from gui.constants import SITE_ICON_PATH
 
 logger = logging.getLogger(__name__)
@@ -221,15 +224,21 @@ class Site(TemplateNode):
             self.base_path = safe_path_join(self.parent.base_path, self.folder_name)
             signal_handler.update_base_path(self.unique_key, self.base_path)
 
+        site_module = importlib.import_module(self.module_name)
+        producer_function = getattr(site_module, self.function_name)
+        change_token_function = getattr(site_module, "change_token", None)
+
         queue_wrapper = QueueWrapper(queue,
                                      signal_handler=signal_handler,
                                      unique_key=self.unique_key,
                                      site_settings=site_settings,
                                      cancellable_pool=cancellable_pool,
+                                     record=change_token_function is not None,
+                                     state_key=self.get_state_key(),
                                      **self.consumer_kwargs)
 
-        site_module = importlib.import_module(self.module_name)
-        producer_function = getattr(site_module, self.function_name)
+        if change_token_function is not None:
+            producer_function = self.memoize_producer(producer_function, change_token_function)
 
         coroutine = self.exception_handler(producer_function, signal_handler)(session=session,
                                                                               queue=queue_wrapper,
@@ -254,6 +263,71 @@ class Site(TemplateNode):
         signal_handler.update_folder_name(self.unique_key, folder_name)
         return folder_name
 
+    def get_state_key(self):
+        """Key for state a producer stores between runs, e.g. its change token"""
+        return f"{self.kwargs_hash}:{self.base_path}"
+
+    def memoize_producer(self, producer_function, change_token_function):
+        """
+        Skips the producer if the change token of the site and the recorded files of the last run
+        didn't change. Otherwise runs the producer and records its items with the new token.
+        """
+        cache_key = self.get_state_key()
+
+        @functools.wraps(producer_function)
+        async def wrapper(session, queue, base_path, site_settings, **kwargs):
+            try:
+                token = await change_token_function(session=session, site_settings=site_settings, **kwargs)
+            except asyncio.CancelledError as e:
+                raise e
+            except Exception as e:
+                logger.debug(f"Could not get the change token of {self.unique_key}. {type(e).__name__}: {e}")
+                token = None
+            table = cache.get_json("change_token")
+            recorded = table.get(cache_key, None)
+            if token is not None and recorded is not None and recorded["token"] == token:
+                if await self.are_items_unchanged(recorded["items"], site_settings):
+                    logger.debug(f"Change token of {self.unique_key} did not change. "
+                                 f"Skipping {len(recorded['items'])} item(s)")
+                    return
+
+            result = await producer_function(session=session, queue=queue, base_path=base_path,
+                                             site_settings=site_settings, **kwargs)
+            if token is not None:
+                table[cache_key] = {
+                    "token": token,
+                    "items": queue.recorded_items,
+                }
+            return result
+
+        return wrapper
+
+    async def are_items_unchanged(self, items, site_settings):
+        allowed_extensions = (self.consumer_kwargs.get("allowed_extensions", None) or []) + \
+                             site_settings.allowed_extensions
+        forbidden_extensions = (self.consumer_kwargs.get("forbidden_extensions", None) or []) + \
+                               site_settings.forbidden_extensions
+
+        for item in items:
+            absolute_path = os.path.join(site_settings.base_path, item["path"])
+            if not item["with_extension"]:
+                extension = cache.get_cached_extension(item["url"])
+                if extension is None or extension == cache.EXTENSION_ERROR:
+                    return False
+                absolute_path += "." + extension
+
+            if is_extension_forbidden(extension=get_extension(os.path.basename(absolute_path)),
+                                      allowed_extensions=allowed_extensions,
+                                      forbidden_extensions=forbidden_extensions):
+                continue
+
+            if not await io_executor.exists(absolute_path):
+                return False
+            if not cache.is_checksum_same(absolute_path, item["checksum"]):
+                return False
+
+        return True
+
     def exception_handler(self, function, signal_handler):
         unique_key = self.unique_key
 
@@ -267,6 +341,7 @@ class Site(TemplateNode):
                 result = await function(session=session, queue=queue, base_path=base_path,
                                         site_settings=site_settings, *args, **kwargs)
                 logger.debug(f"Finished: {function_name_kwargs}, time: {(time.time() - t):.2f}")
+                queue.producer_completed()
                 return result
             except asyncio.CancelledError as e:
                 raise e
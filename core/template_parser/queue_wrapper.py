@@ -2,15 +2,15 @@ import asyncio
 import inspect
 
 
-def queue_wrapper_put(obj, attr, **consumer_kwargs):
+def queue_wrapper_put(obj, attr, recorded_items=None, **consumer_kwargs):
     signal_handler = consumer_kwargs["signal_handler"]
     unique_key = consumer_kwargs["unique_key"]
 
     async def inside(*args, **kwargs):
-        if kwargs.get("item"):
-            kwargs["item"].update(consumer_kwargs)
-        else:
-            args[0].update(consumer_kwargs)
+        item = kwargs["item"] if kwargs.get("item") else args[0]
+        if recorded_items is not None:
+            recorded_items.append(record_item(item))
+        item.update(consumer_kwargs)
         signal_handler.start(unique_key)  # finish signal in downloader
 
         await getattr(obj, attr)(*args, **kwargs)
@@ -18,10 +18,30 @@ def queue_wrapper_put(obj, attr, **consumer_kwargs):
     return inside
 
 
+def record_item(item):
+    return {
+        "path": item["path"],
+        "url": str(item["url"]),
+        "with_extension": item.get("with_extension", True),
+        "checksum": item.get("checksum", None),
+    }
+
+
 class QueueWrapper:
-    def __init__(self, queue, signal_handler, unique_key, site_settings, **kwargs):
+    def __init__(self, queue, signal_handler, unique_key, site_settings, record=False, state_key=None, **kwargs):
         kwargs["signal_handler"] = signal_handler
         kwargs["unique_key"] = unique_key
         kwargs["site_settings"] = site_settings
+        self.queue = queue
+        self.state_key = state_key
         self.consumer_kwargs = kwargs
-        setattr(self, "put", queue_wrapper_put(queue, "put", **kwargs))
+        self.recorded_items = [] if record else None
+        setattr(self, "put", queue_wrapper_put(queue, "put", recorded_items=self.recorded_items, **kwargs))
+
+    def producer_completed(self):
+        self.queue.producer_completed(self.consumer_kwargs["unique_key"])
+
+    def record(self, item):
+        """Records an item which was downloaded without the queue"""
+        if self.recorded_items is not None:
+            self.recorded_items.append(record_item(item))
@@ -1,14 +1,171 @@
 import asyncio
+import collections
 
+from aiohttp.client import URL
 
-class UniqueQueue(asyncio.Queue):
-    def __init__(self):
-        super().__init__()
+
+def get_host(item):
+    url = item["url"]
+    if isinstance(url, str):
+        url = URL(url)
+    return url.host
+
+
+class UniqueQueue(object):
+    """
+    Queue with a sub queue for every host, which are served round robin.
+    An item is only handed out if its host has a free connection slot,
+    so one site with many files can't occupy all consumers.
+    Items with an already used path get a numbered path.
+    Items with a path in `priority_paths` are served before the other items of their host.
+    """
+
+    def __init__(self, limit_per_host=0, priority_paths=None):
+        self.limit_per_host = limit_per_host
+        self.priority_paths = set(priority_paths or [])
+        self.host_limits = {}
         self.paths = {}
+        self.completed_keys = set()
+        self._delayed = {}
+        self._host_queues = {}
+        self._hosts = collections.deque()
+        self._active = collections.Counter()
+        self._unfinished_tasks = 0
+        self._change = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    @property
+    def unfinished_tasks(self):
+        return self._unfinished_tasks
+
+    def qsize(self):
+        return sum(len(host_queue) for host_queue in self._host_queues.values())
+
+    def delayed_size(self):
+        return len(self._delayed)
+
+    def empty(self):
+        return not self._host_queues
+
+    def host_depths(self):
+        return {host: len(host_queue) for host, host_queue in self._host_queues.items()}
+
+    def host_active(self):
+        return {host: count for host, count in self._active.items() if count}
+
+    def producer_completed(self, unique_key):
+        """Marks that the producer of `unique_key` put all of its items without an error"""
+        self.completed_keys.add(unique_key)
+
+    def get_host_limit(self, host):
+        return self.host_limits.get(host, self.limit_per_host)
+
+    def set_host_limit(self, host, limit):
+        self.host_limits[host] = limit
+        self._change.set()
+
+    async def put(self, item):
+        self.put_nowait(item)
+
+    def put_nowait(self, item):
+        self._unfinished_tasks += 1
+        self._finished.clear()
+        self._append(item, make_unique=True, first=item["path"] in self.priority_paths)
+
+    def put_later(self, item, delay):
+        """Puts an already handed out item back after `delay` seconds without renaming its path"""
+        self._unfinished_tasks += 1
+        self._finished.clear()
+        loop = asyncio.get_event_loop()
+        handle = loop.call_later(delay, self._put_delayed, item)
+        self._delayed[id(item)] = (handle, item)
+
+    def _put_delayed(self, item):
+        del self._delayed[id(item)]
+        self._append(item, make_unique=False, first=True)
+
+    def _append(self, item, make_unique, first=False):
+        host = get_host(item)
+        if host not in self._host_queues:
+            self._host_queues[host] = collections.deque()
+            self._hosts.append(host)
+
+        if first:
+            self._host_queues[host].appendleft((item, make_unique))
+        else:
+            self._host_queues[host].append((item, make_unique))
+        self._change.set()
 
     async def get(self):
-        item = await super().get()
+        while True:
+            entry = self._pop()
+            if entry is not None:
+                return self._get_item(*entry)
+            self._change.clear()
+            await self._change.wait()
+
+    def get_nowait(self):
+        entry = self._pop()
+        if entry is None:
+            raise asyncio.QueueEmpty()
+        return self._get_item(*entry)
+
+    def _get_item(self, item, make_unique):
+        if make_unique:
+            return self._make_unique(item)
+        return item
+
+    def task_done(self, item):
+        if self._unfinished_tasks <= 0:
+            raise ValueError("task_done() called too many times")
+
+        self._active[get_host(item)] -= 1
+        self._unfinished_tasks -= 1
+        if self._unfinished_tasks == 0:
+            self._finished.set()
+        self._change.set()
 
+    async def join(self):
+        if self._unfinished_tasks > 0:
+            await self._finished.wait()
+
+    def clear(self):
+        items = [item for host_queue in self._host_queues.values() for item, _ in host_queue]
+        for handle, item in self._delayed.values():
+            handle.cancel()
+            items.append(item)
+        self._delayed.clear()
+        self._host_queues.clear()
+        self._hosts.clear()
+        self._unfinished_tasks -= len(items)
+        if self._unfinished_tasks == 0:
+            self._finished.set()
+        return items
+
+    def _has_free_slot(self, host):
+        limit = self.get_host_limit(host)
+        return not limit or self._active[host] < limit
+
+    def _pop(self):
+        for _ in range(len(self._hosts)):
+            host = self._hosts[0]
+            self._hosts.rotate(-1)
+            if not self._has_free_slot(host):
+                continue
+
+            host_queue = self._host_queues[host]
+            entry = host_queue.popleft()
+            if not host_queue:
+                del self._host_queues[host]
+                self._hosts.remove(host)
+
+            self._active[host] += 1
+            return entry
+
+        return None
+
+    def _make_unique(self, item):
         path = item["path"]
         with_extension = item.get("with_extension", True)
 
@@ -25,4 +182,3 @@ class UniqueQueue(asyncio.Queue):
 
         self.paths[path] += 1
         return item
-
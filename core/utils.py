@@ -53,6 +53,21 @@ def get_extension_from_response(response):
     return extension[1:]
 
 
+def get_validator(headers):
+    etag = headers.get("ETag", None)
+    if etag is not None and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified", None)
+
+
+def get_content_range_start(headers):
+    content_range = headers.get("Content-Range", "")
+    match = re.match(r"bytes (\d+)-", content_range)
+    if match is None:
+        return None
+    return int(match[1])
+
+
 def get_extension(file):
     return file.split(".")[-1]
 
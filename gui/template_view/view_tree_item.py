@@ -97,12 +97,15 @@ class TreeWidgetItem(QTreeWidgetItem):
         self.setText(self.COLUMN_REPLACED_FILE, str(self.replaced_file_count))
         self.setTextAlignment(self.COLUMN_REPLACED_FILE, Qt.AlignRight | Qt.AlignVCenter)
 
+    def get_cache_name(self, name):
+        path_name = self.controller.site_settings.base_path.replace("\\", "").replace("/", "").replace(":", "").replace(
+            ".", "")
+        return name + path_name
+
     def load_from_cache(self, name):
         if self.controller.site_settings.base_path is None:
             return []
-        path_name = self.controller.site_settings.base_path.replace("\\", "").replace("/", "").replace(":", "").replace(
-            ".", "")
-        json = cache.get_json(name + path_name)
+        json = cache.get_json(self.get_cache_name(name))
         if self.template_node.unique_key not in json:
             result = []
             json[self.template_node.unique_key] = result
@@ -110,6 +113,10 @@ class TreeWidgetItem(QTreeWidgetItem):
 
         return json[self.template_node.unique_key]
 
+    def mark_cache_changed(self, name):
+        if self.controller.site_settings.base_path is not None:
+            cache.mark_changed(self.get_cache_name(name))
+
     def emit_data_changed(self):
         self.treeWidget().emit_item_changed(self, 0)
 
@@ -199,6 +206,7 @@ class TreeWidgetItem(QTreeWidgetItem):
             "path": path,
             "timestamp": int(time.time()),
         })
+        self.mark_cache_changed("added_files")
 
     def replaced_file(self, path, old_path=None):
         self.replaced_file_count += 1
@@ -209,6 +217,7 @@ class TreeWidgetItem(QTreeWidgetItem):
             "old_path": old_path,
             "timestamp": int(time.time()),
         })
+        self.mark_cache_changed("added_files")
 
     def get_check_state(self):
         return self.name_widget.get_check_state()
@@ -9,7 +9,13 @@ from PyQt5.QtCore import *
 
 from core import downloader, template_parser, monitor
 from core.cancellable_pool import CancellablePool
+from core.concurrency import ConcurrencyController
+from core.rate_limiter import RateLimiter
+from core.statistics import RunStatistics
 from core import unique_queue
+from core.storage import cache
+from core.storage.utils import reset_garbage_collection
+from settings import advanced_settings
 
 logger = logging.getLogger(__name__)
 
@@ -81,12 +87,27 @@ class Worker(QObject):
                                     limit=self.site_settings.conn_limit,
                                     limit_per_host=self.site_settings.conn_limit_per_host)
 
+        run_start = time.time()
+        reset_garbage_collection()
+        queue = unique_queue.UniqueQueue(limit_per_host=self.site_settings.conn_limit_per_host,
+                                         priority_paths=cache.get_dead_letters().keys())
+        controller = None
+        if self.site_settings.adaptive_concurrency:
+            controller = ConcurrencyController(queue,
+                                               max_consumers=self.site_settings.max_consumers,
+                                               max_per_host=self.site_settings.conn_limit_per_host)
+
+        rate_limiter = RateLimiter(bytes_per_second=self.site_settings.max_download_speed * 1024,
+                                   bytes_per_second_per_host=self.site_settings.max_download_speed_per_host * 1024,
+                                   requests_per_second_per_host=self.site_settings.max_requests_per_host)
+
         async with monitor.MonitorSession(signals=signals, raise_for_status=True, connector=conn,
-                                          timeout=aiohttp.ClientTimeout(30)) as session:
+                                          timeout=aiohttp.ClientTimeout(30), controller=controller,
+                                          rate_limiter=rate_limiter,
+                                          http_cache=self.site_settings.http_cache) as session:
 
             try:
                 logger.debug(f"Loading template: {self.template_path}")
-                queue = unique_queue.UniqueQueue()
                 producers = []
                 cancellable_pool = CancellablePool()
                 template = template_parser.Template(path=self.template_path,
@@ -99,8 +120,14 @@ class Worker(QObject):
                     logger.critical(f"A critical error occurred while passing the template: {e}. Exiting...")
                     return
 
+                cache_flusher = asyncio.ensure_future(
+                    cache.flush_jsons_periodically(advanced_settings.cache_flush_interval,
+                                                   advanced_settings.cache_max_unflushed_changes))
+
                 logger.debug("Starting consumers")
-                consumers = [asyncio.ensure_future(downloader.download_files(session, queue)) for _ in range(20)]
+                statistics = RunStatistics()
+                consumers = [asyncio.ensure_future(downloader.download_files(session, queue, controller, statistics))
+                             for _ in range(self.site_settings.max_consumers)]
 
                 await template.run_from_unique_keys(self.unique_keys,
                                                     producers=producers,
@@ -113,9 +140,17 @@ class Worker(QObject):
                 logger.debug("Gathering producers")
                 await asyncio.gather(*producers)
 
-                logger.debug("Waiting for queue")
+                logger.debug(f"Waiting for queue. Queued items per host: {queue.host_depths()}")
                 await queue.join()
 
+                statistics.log_summary()
+                cache.log_statistics()
+                cache.prune_dead_letters(queue.completed_keys, run_start)
+                dead_letters = cache.get_dead_letters()
+                if dead_letters:
+                    logger.warning(f"{len(dead_letters)} file(s) could not be downloaded. "
+                                   f"They will be tried first on the next run")
+
             except asyncio.CancelledError:
                 return
 
@@ -127,11 +162,11 @@ class Worker(QObject):
                 logger.debug("Cancel consumers")
                 for c in consumers:
                     c.cancel()
+                cache_flusher.cancel()
+                cache.flush_jsons()
 
                 logger.debug("Clearing queue")
-                while not queue.empty():
-                    item = queue.get_nowait()
-                    queue.task_done()
+                for item in queue.clear():
                     signals.site_finished[str].emit(item["unique_key"])
 
                 logger.debug("Shutting down worker pool")
@@ -11,8 +11,14 @@ import colorama
 from core import unique_queue
 from core import downloader, template_parser, monitor
 from core.cancellable_pool import CancellablePool
+from core.concurrency import ConcurrencyController
+from core.rate_limiter import RateLimiter
+from core.statistics import RunStatistics
+from core.storage import cache
+from core.storage.utils import reset_garbage_collection
 from core.constants import VERSION
 from core.utils import async_user_statistics, async_get_latest_version
+from settings import advanced_settings
 from settings.logger import setup_logger
 from settings.settings import SiteSettings, TemplatePathSettings
 
@@ -37,10 +43,24 @@ async def main(signals=None, site_settings=None):
                                 limit=site_settings.conn_limit,
                                 limit_per_host=site_settings.conn_limit_per_host)
 
+    run_start = time.time()
+    reset_garbage_collection()
+    queue = unique_queue.UniqueQueue(limit_per_host=site_settings.conn_limit_per_host,
+                                     priority_paths=cache.get_dead_letters().keys())
+    controller = None
+    if site_settings.adaptive_concurrency:
+        controller = ConcurrencyController(queue,
+                                           max_consumers=site_settings.max_consumers,
+                                           max_per_host=site_settings.conn_limit_per_host)
+
+    rate_limiter = RateLimiter(bytes_per_second=site_settings.max_download_speed * 1024,
+                               bytes_per_second_per_host=site_settings.max_download_speed_per_host * 1024,
+                               requests_per_second_per_host=site_settings.max_requests_per_host)
+
     async with monitor.MonitorSession(signals=signals, raise_for_status=True, connector=conn,
-                                      timeout=aiohttp.ClientTimeout(30)) as session:
+                                      timeout=aiohttp.ClientTimeout(30), controller=controller,
+                                      rate_limiter=rate_limiter, http_cache=site_settings.http_cache) as session:
         logger.debug(f"Loading template: {template_path}")
-        queue = unique_queue.UniqueQueue()
         producers = []
         cancellable_pool = CancellablePool()
         template_file = os.path.join(os.path.dirname(__file__), template_path)
@@ -66,28 +86,51 @@ async def main(signals=None, site_settings=None):
             logger.info(f"A new update is available. Update with 'git pull'."
                         f" New version: {latest_version}. Current version {VERSION}")
 
+        cache_flusher = asyncio.ensure_future(
+            cache.flush_jsons_periodically(advanced_settings.cache_flush_interval,
+                                           advanced_settings.cache_max_unflushed_changes))
+
         logger.debug("Starting consumers")
-        consumers = [asyncio.ensure_future(downloader.download_files(session, queue)) for _ in range(20)]
+        statistics = RunStatistics()
+        consumers = [asyncio.ensure_future(downloader.download_files(session, queue, controller, statistics))
+                     for _ in range(site_settings.max_consumers)]
 
         logger.debug("Gathering producers")
         await asyncio.gather(*producers)
 
         logger.debug("Waiting for queue")
 
-        num_unfinished_downloads = queue.qsize() + queue._unfinished_tasks
+        num_unfinished_downloads = queue.unfinished_tasks
         if num_unfinished_downloads:
             logger.info(f"Waiting for {num_unfinished_downloads} potential download(s) to finish")
+            logger.debug(f"Queued items per host: {queue.host_depths()}")
         await queue.join()
 
         logger.debug("Cancel consumers")
         for c in consumers:
             c.cancel()
+        cache_flusher.cancel()
 
         cancellable_pool.shutdown()
 
+        statistics.log_summary()
+        cache.log_statistics()
+        cache.prune_dead_letters(queue.completed_keys, run_start)
+        log_dead_letters()
+
         await user_statistic
 
 
+def log_dead_letters():
+    dead_letters = cache.get_dead_letters()
+    if not dead_letters:
+        return
+
+    logger.warning(f"{len(dead_letters)} file(s) could not be downloaded. They will be tried first on the next run")
+    for path, dead_letter in dead_letters.items():
+        logger.info(f"Failed after {dead_letter['attempts']} attempt(s): {path}. {dead_letter['error']}")
+
+
 if __name__ == '__main__':
     start_t = time.time()
     startup_time = time.process_time()
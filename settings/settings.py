@@ -74,6 +74,12 @@ class AdvancedSettings(Settings):
                              gui_name="Loglevel",
                              require_restart=True)
     check_for_updates = ConfigBool(default=True, gui_name="Check for Updates")
+    cache_flush_interval = ConfigInt(minimum=0, default=30, gui_name="Save Cache every (s)",
+                                     hint_text="Changed cache tables are written in the background.<br>"
+                                               "0 to only save them at exit")
+    cache_max_unflushed_changes = ConfigInt(minimum=0, default=1000,
+                                            gui_name="Save Cache after Number of Changes",
+                                            hint_text="0 for no limit")
 
 
 class TemplatePathSettings(Settings):
@@ -113,6 +119,41 @@ class SiteSettings(Settings):
                            hint_text="0 for unlimited")
     conn_limit_per_host = ConfigInt(minimum=0, default=5, gui_name="Maximum Number of Connections per Host",
                                     hint_text="0 for unlimited")
+    max_consumers = ConfigInt(minimum=1, maximum=100, default=20, gui_name="Maximum Number of Parallel Downloads")
+    adaptive_concurrency = ConfigBool(default=True,
+                                      gui_name="Adapt Parallel Downloads to the Connection",
+                                      hint_text="Lowers the number of parallel downloads and connections per host<br>"
+                                                "on errors and slow responses. The maximums above are upper bounds.")
+    max_download_speed = ConfigInt(minimum=0, default=0, maximum=10 ** 7, gui_name="Maximum Download Speed (KB/s)",
+                                   hint_text="0 for unlimited")
+    max_download_speed_per_host = ConfigInt(minimum=0, default=0, maximum=10 ** 7,
+                                            gui_name="Maximum Download Speed per Host (KB/s)",
+                                            hint_text="0 for unlimited")
+    max_requests_per_host = ConfigInt(minimum=0, default=0, gui_name="Maximum Requests per Second per Host",
+                                      hint_text="0 for unlimited")
+    stall_timeout = ConfigInt(minimum=0, default=60, gui_name="Abort Downloads without Data after (s)",
+                              hint_text="Stalled downloads are retried or resumed later.<br>0 to disable")
+    stall_min_speed = ConfigInt(minimum=0, default=1, gui_name="Minimum Download Speed (KB/s)",
+                                hint_text="Downloads slower than this over one minute are aborted.<br>0 to disable")
+    segmented_download_threshold = ConfigInt(minimum=0, default=50,
+                                             gui_name="Minimum File Size for Segmented Downloads (MB)",
+                                             hint_text="Large files are downloaded in multiple parts at once.<br>"
+                                                       "0 to disable")
+    segmented_download_segments = ConfigInt(minimum=1, maximum=32, default=4,
+                                            gui_name="Number of Segments per Download",
+                                            hint_text="Limited by the maximum number of connections per host")
+    archive_download_threshold = ConfigInt(minimum=0, maximum=100, default=50,
+                                           gui_name="Download Folders as Archive (% changed)",
+                                           hint_text="New Moodle and Polybox folders and folders with more changed "
+                                                     "files<br>than this percentage are downloaded as one zip. "
+                                                     "0 to disable")
+    http_cache = ConfigBool(default=False, gui_name="Cache Listing Pages",
+                            hint_text="Listing pages are revalidated with ETag and Last-Modified "
+                                      "and only parsed again if they changed")
+    download_buffer_size = ConfigInt(minimum=0, maximum=16384, default=1024,
+                                     gui_name="Download Buffer Size (KB)",
+                                     hint_text="Larger buffers need less CPU on fast connections.<br>"
+                                               "0 to write every received chunk on its own")
 
 
 class GUISettings(Settings):
@@ -2,11 +2,11 @@ import asyncio
 import datetime
 import locale
 
-import aiohttp
 from bs4 import SoupStrainer
 
 from core.constants import *
 from core.exceptions import LoginError
+from core.monitor import MonitorSession
 from core.utils import *
 from settings.config import ConfigString
 from sites.ilias import login
@@ -17,10 +17,12 @@ ILIAS_ID_CONFIG = ConfigString(gui_name="ID")
 
 async def get_folder_name(session, ilias_id, **kwargs):
     url = GOTO_URL + str(ilias_id)
-    async with session.get(url) as response:
-        html = await response.text()
+    page = await session.get_page(url, parser=parse_folder_name)
+    return page.parsed
 
-    soup = BeautifulSoup(html, BEAUTIFUL_SOUP_PARSER)
+
+def parse_folder_name(page):
+    soup = BeautifulSoup(page.text, BEAUTIFUL_SOUP_PARSER)
 
     ol = soup.find("ol", class_="breadcrumb")
     return str(ol.find_all("li")[2].string)
@@ -32,21 +34,33 @@ async def producer(session, queue, base_path, site_settings, ilias_id: ILIAS_ID_
 
 async def search_tree(session, queue, base_path, site_settings, ilias_id):
     url = GOTO_URL + str(ilias_id)
-    async with session.get(url) as response:
-        html = await response.text()
-        if str(response.url) != url:
-            raise LoginError("Module ilias isn't logged in")
+    page = await session.get_page(url, parser=parse_tree)
+    if page.url != url:
+        raise LoginError("Module ilias isn't logged in")
+
+    tasks = []
+    for name, href, extension, checksum in page.parsed:
+        path = safe_path_join(base_path, name)
+        if extension is not None:
+            await queue.put({"url": href, "path": f"{path}.{extension}", "checksum": checksum})
+        else:
+            ref_id = re.search("ref_id=([0-9]+)&", href).group(1)
+            coroutine = search_tree(session, queue, path, site_settings, ref_id)
+            tasks.append(asyncio.ensure_future(coroutine))
 
+    await asyncio.gather(*tasks)
+
+
+def parse_tree(page):
     strainer = SoupStrainer("div", attrs={"class": "ilCLI ilObjListRow row"})
-    soup = BeautifulSoup(html, BEAUTIFUL_SOUP_PARSER, parse_only=strainer)
+    soup = BeautifulSoup(page.text, BEAUTIFUL_SOUP_PARSER, parse_only=strainer)
     rows = soup.find_all("div", attrs={"class": "ilCLI ilObjListRow row"})
-    tasks = []
+    result = []
     for row in rows:
         content = row.find("div", attrs={"class": "ilContainerListItemContent"})
         link = content.find("a")
         href = link["href"]
         name = str(link.string)
-        path = safe_path_join(base_path, name)
         if "download" in href:
             extension = str(content.find("span", attrs={"class": "il_ItemProperty"}).string).strip()
             checksum = "".join([str(x.string).strip() for x in
@@ -62,18 +76,16 @@ async def search_tree(session, queue, base_path, site_settings, ilias_id):
                 checksum = checksum.replace("Yesterday", yesterday_date.strftime("%d. %b %Y"))
             locale.setlocale(locale.LC_TIME, "")
 
-            await queue.put({"url": href, "path": f"{path}.{extension}", "checksum": checksum})
+            result.append([name, href, extension, checksum])
         else:
-            ref_id = re.search("ref_id=([0-9]+)&", href).group(1)
-            coroutine = search_tree(session, queue, path, site_settings, ref_id)
-            tasks.append(asyncio.ensure_future(coroutine))
+            result.append([name, href, None, None])
 
-    await asyncio.gather(*tasks)
+    return result
 
 
 if __name__ == "__main__":
     async def main():
-        async with aiohttp.ClientSession(raise_for_status=True) as session:
+        async with MonitorSession(signals=None, raise_for_status=True) as session:
             await login(session)
             await get_folder_name(session, "187834")
 
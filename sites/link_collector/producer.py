@@ -104,12 +104,15 @@ def _get_file_name(url_file_name: str,
 
 
 async def get_all_file_links(session, url, session_kwargs):
-    async with session.get(url, **session_kwargs) as response:
-        html = await response.text()
+    page = await session.get_page(url, parser=parse_file_links, **session_kwargs)
+    return [tuple(link) for link in page.parsed]
 
+
+def parse_file_links(page):
+    url = page.url
     all_links = set([])
 
-    soup = BeautifulSoup(html, BEAUTIFUL_SOUP_PARSER)
+    soup = BeautifulSoup(page.text, BEAUTIFUL_SOUP_PARSER)
 
     links = soup.find_all("a")
     for link in links:
@@ -126,13 +129,16 @@ async def get_all_file_links(session, url, session_kwargs):
 
         all_links.add((result, str(link.string)))
 
-    return all_links
+    return sorted(all_links)
 
 
 async def get_folder_name(session, url, **kwargs):
-    async with session.get(url) as response:
-        html = await response.text()
-    soup = BeautifulSoup(html, BEAUTIFUL_SOUP_PARSER)
+    page = await session.get_page(url, parser=parse_title)
+    return page.parsed
+
+
+def parse_title(page):
+    soup = BeautifulSoup(page.text, BEAUTIFUL_SOUP_PARSER)
     title = soup.find("title")
 
     return str(title.string)
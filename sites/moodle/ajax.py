@@ -0,0 +1,83 @@
+import asyncio
+import logging
+
+from .constants import AJAX_SERVICE_URL
+
+logger = logging.getLogger(__name__)
+
+BATCH_WINDOW = 0.05
+
+
+def get_batcher(session):
+    """The batcher lives on the session, so both are freed together"""
+    batcher = getattr(session, "moodle_ajax_batcher", None)
+    if batcher is None:
+        batcher = AjaxBatcher(session)
+        session.moodle_ajax_batcher = batcher
+    return batcher
+
+
+async def call(session, sesskey, methodname, args):
+    return await get_batcher(session).call(sesskey, methodname, args)
+
+
+class AjaxBatcher(object):
+    """
+    Collects the AJAX calls of all moodle producers of a session for `window` seconds
+    and sends them in one request to service.php.
+    Moodle stops at the first call which fails, so calls without a response are sent again.
+    """
+
+    def __init__(self, session, window=BATCH_WINDOW):
+        self.session = session
+        self.window = window
+        self._pending = []
+        self._task = None
+
+    async def call(self, sesskey, methodname, args):
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append((sesskey, {"methodname": methodname, "args": args}, future))
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._send_later())
+        return await future
+
+    async def _send_later(self):
+        await asyncio.sleep(self.window)
+        pending, self._pending = self._pending, []
+        self._task = None
+
+        by_sesskey = {}
+        for sesskey, method_call, future in pending:
+            by_sesskey.setdefault(sesskey, []).append((method_call, future))
+
+        await asyncio.gather(*[self._send(sesskey, calls) for sesskey, calls in by_sesskey.items()])
+
+    async def _send(self, sesskey, calls):
+        while calls:
+            payload = [{"index": index, **method_call} for index, (method_call, _) in enumerate(calls)]
+            logger.debug(f"Sending {len(payload)} moodle ajax call(s) in one request")
+            try:
+                async with self.session.post(AJAX_SERVICE_URL, json=payload,
+                                             params={"sesskey": sesskey}) as response:
+                    results = await response.json()
+            except Exception as e:
+                for _, future in calls:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            if not isinstance(results, list):
+                results = [results]
+
+            for (_, future), result in zip(calls, results):
+                if not future.done():
+                    future.set_result(result)
+
+            remaining = calls[len(results):]
+            if len(remaining) == len(calls):
+                error = ValueError("Moodle did not answer any of the ajax calls")
+                for _, future in remaining:
+                    if not future.done():
+                        future.set_exception(error)
+                return
+            calls = remaining
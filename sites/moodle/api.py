@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+
+from core.archive_download import ItemCollector, put_folder_items
+from core.exceptions import ForbiddenError
+from core.utils import safe_path_join
+from sites.moodle import ajax
+from sites.moodle.parser import process_link, exception_handler, get_folder_archive_url, get_update_args, \
+    parse_update_json
+from sites.moodle.sync import SyncCursor
+from .constants import BASE_URL, MTYPE_DIRECTORY, MTYPE_FILE, MTYPE_EXTERNAL_LINK, MTYPE_ASSIGN
+
+logger = logging.getLogger(__name__)
+
+WEBSERVICE_PLUGINFILE_URL = BASE_URL + "/webservice/pluginfile.php"
+PLUGINFILE_URL = BASE_URL + "/pluginfile.php"
+
+
+async def parse_course_contents(session,
+                                queue,
+                                sesskey,
+                                base_path,
+                                site_settings,
+                                moodle_id,
+                                process_external_links,
+                                keep_section_order,
+                                password_mapper):
+    """
+    Builds the queue items from core_course_get_contents and mod_assign_get_assignments
+    instead of scraping course/view.php and the folder and assignment pages.
+    The paths and checksums are the same as the ones of the html engine, so both share the sync cursor.
+    Raises a ForbiddenError before anything is queued if moodle doesn't allow the functions.
+    """
+    sync_cursor = SyncCursor(queue.state_key, moodle_id)
+    contents, assignments, update_response = await asyncio.gather(
+        ajax.call(session, sesskey, "core_course_get_contents", {"courseid": int(moodle_id)}),
+        ajax.call(session, sesskey, "mod_assign_get_assignments", {"courseids": [int(moodle_id)]}),
+        ajax.call(session, sesskey, "core_course_get_updates_since",
+                  get_update_args(moodle_id, since=sync_cursor.since)),
+    )
+    sections = get_data(contents)
+    intro_attachments = get_intro_attachments(get_data(assignments))
+    last_updated_dict = sync_cursor.apply_updates(parse_update_json(update_response,
+                                                                    strict=sync_cursor.full_sync))
+
+    tasks = []
+    for index, section in enumerate(sections):
+        section_name = section["name"]
+        if keep_section_order:
+            section_name = f"[{index + 1:02}] {section_name}"
+        section_path = safe_path_join(base_path, section_name)
+
+        for module in section["modules"]:
+            module_id = module["id"]
+            if not await sync_cursor.is_changed(module_id, queue, site_settings):
+                continue
+
+            module_queue = sync_cursor.module_queue(queue, module_id)
+            last_updated = last_updated_dict.get(module_id, None)
+            modname = module["modname"]
+            if modname == MTYPE_FILE:
+                await put_resource(module_queue, module, section_path, last_updated)
+            elif modname == MTYPE_DIRECTORY:
+                # Folders which are displayed inline on the course page have no view link
+                if module.get("noviewlink", False):
+                    folder_path = section_path
+                else:
+                    folder_path = safe_path_join(section_path, module["name"])
+                collector = ItemCollector(module_queue)
+                await put_files(collector, module.get("contents", []), folder_path, last_updated)
+                await put_folder_items(session, module_queue, collector.items, get_folder_archive_url(module_id),
+                                       folder_path)
+            elif modname == MTYPE_ASSIGN:
+                files = intro_attachments.get(module["instance"], [])
+                await put_files(module_queue, files, safe_path_join(section_path, module["name"]))
+            elif modname == MTYPE_EXTERNAL_LINK and process_external_links:
+                url = get_external_url(module)
+                if url is None:
+                    continue
+                coroutine = process_link(session=session,
+                                         queue=module_queue,
+                                         base_path=section_path,
+                                         site_settings=site_settings,
+                                         url=url,
+                                         moodle_id=moodle_id,
+                                         name=module["name"],
+                                         password_mapper=password_mapper)
+                tasks.append(asyncio.ensure_future(exception_handler(coroutine, moodle_id, url)))
+
+    await asyncio.gather(*tasks)
+    sync_cursor.save()
+
+
+def get_data(response):
+    if response["error"]:
+        raise ForbiddenError(response["exception"]["errorcode"] + ", " + response["exception"]["message"])
+    return response["data"]
+
+
+def get_intro_attachments(assignments):
+    result = {}
+    for course in assignments["courses"]:
+        for assignment in course["assignments"]:
+            result[assignment["id"]] = assignment.get("introattachments", [])
+    return result
+
+
+def get_external_url(module):
+    for content in module.get("contents", []):
+        if content["type"] == "url":
+            return content["fileurl"]
+    return None
+
+
+def to_pluginfile_url(url):
+    """Files of the web service need a token, the normal pluginfile.php works with the session cookies"""
+    return url.replace(WEBSERVICE_PLUGINFILE_URL, PLUGINFILE_URL)
+
+
+async def put_resource(queue, module, base_path, last_updated):
+    """Puts the same item as the html engine, which only knows the extension of pdfs"""
+    files = [content for content in module.get("contents", []) if content["type"] == "file"]
+    if not files:
+        return
+
+    main_file = files[0]
+    with_extension = os.path.splitext(main_file["filename"])[1].lower() == ".pdf"
+    file_name = module["name"] + ".pdf" if with_extension else module["name"]
+    await queue.put({"path": safe_path_join(base_path, file_name),
+                     "url": module["url"] + "&redirect=1",
+                     "with_extension": with_extension,
+                     "checksum": last_updated,
+                     "size": main_file.get("filesize", None)})
+
+
+async def put_files(queue, files, base_path, last_updated=None):
+    """Folder files use the last update of their module as checksum, assignment files their own time"""
+    for file in files:
+        if file.get("type", "file") != "file":
+            continue
+
+        sub_folders = [part for part in file.get("filepath", "/").split("/") if part]
+        await queue.put({"path": safe_path_join(base_path, *sub_folders, file["filename"]),
+                         "url": to_pluginfile_url(file["fileurl"]),
+                         "checksum": last_updated if last_updated is not None else str(file["timemodified"]),
+                         "size": file.get("filesize", None)})
@@ -7,6 +7,9 @@ MTYPE_EXTERNAL_LINK = "url"
 MTYPE_DIRECTORY = "folder"
 MTYPE_ASSIGN = "assign"
 
+ENGINE_HTML = "html"
+ENGINE_API = "api"
+
 UPDATE_REQUEST_PAYLOAD = [{
     "index": 0,
     "methodname": "core_course_get_updates_since",
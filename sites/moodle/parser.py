@@ -8,6 +8,7 @@ from mimetypes import guess_extension
 from aiohttp.client_exceptions import ClientResponseError
 from bs4 import BeautifulSoup, SoupStrainer
 
+from core.archive_download import ItemCollector, put_folder_items
 from core.constants import BEAUTIFUL_SOUP_PARSER
 from core.downloader import is_extension_forbidden
 from core.exceptions import ForbiddenError
@@ -15,8 +16,9 @@ from core.storage.cache import check_url_reference
 from core.storage.utils import call_function_or_cache
 from core.utils import safe_path_join, safe_path
 from sites import polybox, one_drive
-from sites.moodle import zoom
-from .constants import AJAX_SERVICE_URL, MTYPE_DIRECTORY, MTYPE_FILE, MTYPE_EXTERNAL_LINK, MTYPE_ASSIGN
+from sites.moodle import ajax, zoom
+from sites.moodle.sync import SyncCursor
+from .constants import BASE_URL, MTYPE_DIRECTORY, MTYPE_FILE, MTYPE_EXTERNAL_LINK, MTYPE_ASSIGN
 
 logger = logging.getLogger(__name__)
 
@@ -30,12 +32,13 @@ async def parse_main_page(session,
                           process_external_links,
                           keep_section_order,
                           password_mapper):
-    sesskey = re.search(b"""sesskey":"([^"]+)""", html)[1].decode("utf-8")
-    async with session.post(AJAX_SERVICE_URL, json=get_update_payload(moodle_id),
-                            params={"sesskey": sesskey}) as response:
-        update_json = await response.json()
+    sesskey = get_sesskey(html)
+    sync_cursor = SyncCursor(queue.state_key, moodle_id)
+    update_response = await ajax.call(session, sesskey, "core_course_get_updates_since",
+                                      get_update_args(moodle_id, since=sync_cursor.since))
 
-    last_updated_dict = parse_update_json(update_json)
+    last_updated_dict = sync_cursor.apply_updates(parse_update_json(update_response,
+                                                                    strict=sync_cursor.full_sync))
 
     only_sections = SoupStrainer("li", id=re.compile("section-([0-9]+)"))
     soup = BeautifulSoup(html, BEAUTIFUL_SOUP_PARSER, parse_only=only_sections)
@@ -50,11 +53,17 @@ async def parse_main_page(session,
                                  moodle_id=moodle_id,
                                  process_external_links=process_external_links,
                                  last_updated_dict=last_updated_dict,
+                                 sync_cursor=sync_cursor,
                                  password_mapper=password_mapper,
                                  index=index,
                                  keep_section_order=keep_section_order)
                   for index, section in enumerate(sections)]
     await asyncio.gather(*coroutines)
+    sync_cursor.save()
+
+
+def get_sesskey(html):
+    return re.search(b"""sesskey":"([^"]+)""", html)[1].decode("utf-8")
 
 
 async def parse_sections(session,
@@ -65,6 +74,7 @@ async def parse_sections(session,
                          moodle_id,
                          process_external_links,
                          last_updated_dict,
+                         sync_cursor,
                          password_mapper,
                          index=None,
                          keep_section_order=False):
@@ -76,8 +86,13 @@ async def parse_sections(session,
     modules = section.find_all("li", id=re.compile("module-[0-9]+"))
     tasks = []
     for module in modules:
+        module_id = int(re.search("module-([0-9]+)", module["id"])[1])
+        if not await sync_cursor.is_changed(module_id, queue, site_settings):
+            continue
+
+        module_queue = sync_cursor.module_queue(queue, module_id)
         coroutine = parse_mtype(session=session,
-                                queue=queue,
+                                queue=module_queue,
                                 site_settings=site_settings,
                                 base_path=base_path,
                                 module=module,
@@ -96,7 +111,7 @@ async def parse_sections(session,
                     continue
 
                 coroutine = process_link(session=session,
-                                         queue=queue,
+                                         queue=module_queue,
                                          base_path=base_path,
                                          site_settings=site_settings,
                                          url=url,
@@ -141,7 +156,7 @@ async def parse_mtype(session,
 
     elif mtype == MTYPE_DIRECTORY:
         last_updated = last_updated_dict[module_id]
-        await parse_folder(session, queue, site_settings, module, base_path, last_updated)
+        await parse_folder(session, queue, site_settings, module, module_id, base_path, last_updated)
 
     elif mtype == MTYPE_EXTERNAL_LINK:
         if not process_external_links:
@@ -170,10 +185,11 @@ async def parse_mtype(session,
             last_updated = last_updated_dict[module_id]
             name = str(instance.a.span.contents[0])
 
-            assign_file_tree_soup_soup = await call_function_or_cache(get_assign_files_tree,
-                                                                      last_updated,
-                                                                      session,
-                                                                      href)
+            assign_files_tree_html = await call_function_or_cache(get_assign_files_tree,
+                                                                  last_updated,
+                                                                  session,
+                                                                  href)
+            assign_file_tree_soup_soup = parse_assign_files_tree_html(assign_files_tree_html)
 
             await parse_assign_files_tree(queue=queue,
                                           soup=assign_file_tree_soup_soup,
@@ -182,24 +198,31 @@ async def parse_mtype(session,
 
 async def get_filemanager(session, href):
     async with session.get(href) as response:
-        text = await response.text()
+        return await response.text()
 
+
+def parse_filemanager_html(html):
     only_file_tree = SoupStrainer("div", id=re.compile("folder_tree[0-9]+"), class_="filemanager")
-    return BeautifulSoup(text, BEAUTIFUL_SOUP_PARSER, parse_only=only_file_tree)
+    return BeautifulSoup(html, BEAUTIFUL_SOUP_PARSER, parse_only=only_file_tree)
 
 
 async def get_assign_files_tree(session, href):
     async with session.get(href) as response:
-        text = await response.text()
+        return await response.text()
+
 
+def parse_assign_files_tree_html(html):
     assign_files_tree = SoupStrainer("div", id=re.compile("assign_files_tree[0-9a-f]*"))
-    return BeautifulSoup(text, BEAUTIFUL_SOUP_PARSER, parse_only=assign_files_tree)
+    return BeautifulSoup(html, BEAUTIFUL_SOUP_PARSER, parse_only=assign_files_tree)
 
 
-async def parse_folder(session, queue, site_settings, module, base_path, last_updated):
+async def parse_folder(session, queue, site_settings, module, module_id, base_path, last_updated):
+    collector = ItemCollector(queue)
+    archive_url = get_folder_archive_url(module_id)
     folder_tree = module.find("div", id=re.compile("folder_tree[0-9]+"), class_="filemanager")
     if folder_tree is not None:
-        await parse_folder_tree(queue, folder_tree.ul, base_path, last_updated)
+        await parse_folder_tree(collector, folder_tree.ul, base_path, last_updated)
+        await put_folder_items(session, queue, collector.items, archive_url, base_path)
         return
 
     instance = module.find("div", class_="activityinstance")
@@ -208,9 +231,15 @@ async def parse_folder(session, queue, site_settings, module, base_path, last_up
 
     href = instance.a["href"]
 
-    folder_soup = await call_function_or_cache(get_filemanager, last_updated, session, href)
+    folder_html = await call_function_or_cache(get_filemanager, last_updated, session, href)
+    folder_soup = parse_filemanager_html(folder_html)
+
+    await parse_sub_folders(collector, folder_soup, folder_path, last_updated)
+    await put_folder_items(session, queue, collector.items, archive_url, folder_path)
+
 
-    await parse_sub_folders(queue, folder_soup, folder_path, last_updated)
+def get_folder_archive_url(module_id):
+    return f"{BASE_URL}/mod/folder/download_folder.php?id={module_id}"
 
 
 async def parse_sub_folders(queue, soup, folder_path, last_updated):
@@ -262,34 +291,28 @@ async def exception_handler(coroutine, moodle_id, url):
                      f"while trying to access {url}, Error: {type(e).__name__}: {e}", exc_info=True)
 
 
-def get_update_payload(courseid, since=0):
-    return [{
-        "index": 0,
-        "methodname": "core_course_get_updates_since",
-        "args": {
-            "courseid": courseid,
-            "since": since,
-        }
-    }]
+def get_update_args(courseid, since=0):
+    return {
+        "courseid": courseid,
+        "since": since,
+    }
 
 
-def parse_update_json(update_json):
-    if update_json[0]["error"]:
-        raise ForbiddenError(update_json[0]["exception"]["errorcode"] + ", " + update_json[0]["exception"]["message"])
+def parse_update_json(update_response, strict=True):
+    if update_response["error"]:
+        raise ForbiddenError(update_response["exception"]["errorcode"] + ", " + update_response["exception"]["message"])
 
     result = {}
-    for instance in update_json[0]["data"]["instances"]:
+    for instance in update_response["data"]["instances"]:
         if instance["contextlevel"] != "module":
             continue
 
         instance_id = instance["id"]
-        last_update = None
-        for update in instance["updates"]:
-            if update["name"] == "configuration":
-                last_update = update["timeupdated"]
-                break
+        # Every area (configuration, contentfiles, introfiles, ...) can change the files of a module
+        times = [update["timeupdated"] for update in instance["updates"] if update.get("timeupdated", None)]
+        last_update = max(times) if times else None
 
-        if last_update is None:
+        if last_update is None and strict:
             raise ValueError(f"Did not found a timeupdated field in {instance['updates']}")
 
         result[instance_id] = last_update
@@ -1,10 +1,15 @@
+import logging
+
 from bs4 import BeautifulSoup
 
 from core.constants import BEAUTIFUL_SOUP_PARSER
-from core.exceptions import LoginError
-from sites.moodle.parser import parse_main_page
-from .constants import AUTH_URL
-from settings.config_objs import ConfigList, ConfigDict, ConfigString, ConfigBool
+from core.exceptions import ForbiddenError, LoginError
+from sites.moodle.api import parse_course_contents
+from sites.moodle.parser import parse_main_page, get_sesskey
+from .constants import AUTH_URL, ENGINE_HTML, ENGINE_API
+from settings.config_objs import ConfigList, ConfigDict, ConfigString, ConfigBool, ConfigOptions
+
+logger = logging.getLogger(__name__)
 
 PASSWORD_MAPPER_CONFIG = ConfigList(
     gui_name="Password Mapper",
@@ -29,6 +34,12 @@ MOODLE_ID_CONFIG = ConfigString(gui_name="ID")
 
 PROCESS_EXTERNAL_LINKS_CONFIG = ConfigBool(default=True, gui_name="Process External Links", optional=True)
 KEEP_SECTION_ORDER_CONFIG = ConfigBool(default=False, gui_name="Keep Section Order", optional=True)
+ENGINE_CONFIG = ConfigOptions(default=ENGINE_HTML,
+                              options=[ENGINE_HTML, ENGINE_API],
+                              optional=True,
+                              gui_name="Engine",
+                              hint_text="html: Parses the course page.<br>"
+                                        "api: Uses the Moodle web service functions, which need less requests")
 
 
 async def producer(session,
@@ -38,14 +49,30 @@ async def producer(session,
                    moodle_id: MOODLE_ID_CONFIG,
                    process_external_links: PROCESS_EXTERNAL_LINKS_CONFIG = True,
                    keep_section_order: KEEP_SECTION_ORDER_CONFIG = False,
-                   password_mapper: PASSWORD_MAPPER_CONFIG = None):
-    async with session.get(f"https://moodle-app2.let.ethz.ch/course/view.php?id={moodle_id}") as response:
-        html = await response.read()
-        if str(response.url) == AUTH_URL:
-            raise LoginError("Module moodle isn't logged in")
+                   password_mapper: PASSWORD_MAPPER_CONFIG = None,
+                   engine: ENGINE_CONFIG = ENGINE_HTML):
+    page = await session.get_page(f"https://moodle-app2.let.ethz.ch/course/view.php?id={moodle_id}")
+    if page.url == AUTH_URL:
+        raise LoginError("Module moodle isn't logged in")
+
+    if engine == ENGINE_API:
+        try:
+            return await parse_course_contents(session,
+                                               queue,
+                                               get_sesskey(page.body),
+                                               base_path,
+                                               site_settings,
+                                               moodle_id,
+                                               process_external_links,
+                                               keep_section_order,
+                                               password_mapper)
+        except ForbiddenError as e:
+            logger.warning(f"The moodle web service functions are not available for {moodle_id}. {e}. "
+                           f"Parsing the course page instead")
+
     return await parse_main_page(session,
                                  queue,
-                                 html,
+                                 page.body,
                                  base_path,
                                  site_settings,
                                  moodle_id,
@@ -55,9 +82,13 @@ async def producer(session,
 
 
 async def get_folder_name(session, moodle_id, **kwargs):
-    async with session.get(f"https://moodle-app2.let.ethz.ch/course/view.php?id={moodle_id}") as response:
-        html = await response.read()
-    soup = BeautifulSoup(html, BEAUTIFUL_SOUP_PARSER)
+    page = await session.get_page(f"https://moodle-app2.let.ethz.ch/course/view.php?id={moodle_id}",
+                                  parser=parse_folder_name)
+    return page.parsed
+
+
+def parse_folder_name(page):
+    soup = BeautifulSoup(page.body, BEAUTIFUL_SOUP_PARSER)
 
     header = soup.find("div", class_="page-header-headings")
     header_name = str(header.h1.string)
@@ -0,0 +1,85 @@
+import logging
+import time
+
+from core.archive_download import get_pending_items
+from core.storage import cache
+from core.template_parser.queue_wrapper import record_item
+
+logger = logging.getLogger(__name__)
+
+FULL_SYNC_INTERVAL = 7 * 24 * 60 * 60
+SINCE_MARGIN = 5 * 60
+
+
+class SyncCursor(object):
+    """
+    Stores per site when it was synced the last time, the last update and the items of every module,
+    so only the updates since the last sync have to be requested. Modules without updates are skipped
+    as long as their items are still the same locally.
+    Every `FULL_SYNC_INTERVAL` seconds all modules are synced again.
+    """
+
+    def __init__(self, key, moodle_id):
+        self.key = key
+        self.start = time.time()
+        state = cache.get_json("moodle_sync").get(self.key, {})
+        self.modules = dict(state.get("modules", {}))
+        self.items = dict(state.get("items", {}))
+        self.last_full_sync = state.get("last_full_sync", 0)
+        self.full_sync = not self.modules or self.start - self.last_full_sync > FULL_SYNC_INTERVAL
+        self.since = 0 if self.full_sync else state.get("since", 0)
+        self.changed = set()
+
+        if self.full_sync:
+            logger.debug(f"Full sync of moodle course {moodle_id}")
+            self.modules = {}
+            self.items = {}
+            self.last_full_sync = self.start
+
+    def apply_updates(self, updates):
+        """Merges the updates of the modules and returns the last update of every known module"""
+        for module_id, last_update in updates.items():
+            self.changed.add(module_id)
+            if last_update is not None:
+                self.modules[str(module_id)] = last_update
+            else:
+                # No updated area has a time, so there is no better checksum than the time of this sync
+                self.modules[str(module_id)] = int(self.start)
+        return {int(module_id): last_update for module_id, last_update in self.modules.items()}
+
+    async def is_changed(self, module_id, queue, site_settings):
+        if self.full_sync or module_id in self.changed or str(module_id) not in self.modules:
+            return True
+
+        if await get_pending_items(queue, self.items.get(str(module_id), []), site_settings):
+            logger.debug(f"Files of the unchanged module {module_id} are missing or changed locally")
+            return True
+        return False
+
+    def module_queue(self, queue, module_id):
+        """Returns a queue which records the items of the module"""
+        self.items[str(module_id)] = []
+        return ModuleQueue(queue, self.items[str(module_id)])
+
+    def save(self):
+        cache.get_json("moodle_sync")[self.key] = {
+            "since": int(self.start - SINCE_MARGIN),
+            "modules": self.modules,
+            "items": self.items,
+            "last_full_sync": self.last_full_sync,
+        }
+
+
+class ModuleQueue(object):
+    def __init__(self, queue, items):
+        self.queue = queue
+        self.consumer_kwargs = queue.consumer_kwargs
+        self.items = items
+
+    async def put(self, item):
+        self.items.append(record_item(item))
+        await self.queue.put(item)
+
+    def record(self, item):
+        self.items.append(record_item(item))
+        self.queue.record(item)
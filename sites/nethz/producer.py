@@ -13,9 +13,12 @@ URL_CONFIG = ConfigString(gui_name="Url")
 
 
 async def get_folder_name(session, url, **kwargs):
-    async with session.get(url) as response:
-        html = await response.text()
-    soup = BeautifulSoup(html, BEAUTIFUL_SOUP_PARSER)
+    page = await session.get_page(url, parser=parse_folder_name)
+    return page.parsed
+
+
+def parse_folder_name(page):
+    soup = BeautifulSoup(page.text, BEAUTIFUL_SOUP_PARSER)
 
     header_name = str(soup.head.title.string)
     name = re.search("/~([^/]+)/", header_name)[1]
@@ -32,25 +35,13 @@ async def _producer(session, queue, url, base_path, session_kwargs):
     if url[-1] != "/":
         url += "/"
 
-    async with session.get(url, **session_kwargs) as response:
-        html = await response.text()
+    page = await session.get_page(url, parser=parse_index, **session_kwargs)
 
-    soup = BeautifulSoup(html, BEAUTIFUL_SOUP_PARSER)
-
-    links = soup.find_all("a")
     tasks = []
-    for link in links:
-        href = link.get("href")
-        if href != str(link.string).strip():
-            continue
-
-        if href[-1] == "/":
-            href = href[:-1]
-
+    for href, checksum in page.parsed:
         path = safe_path_join(base_path, href)
 
-        if "." in href:
-            checksum = str(link.next_sibling.string).strip()
+        if checksum is not None:
             await queue.put({"url": url + href,
                              "path": path,
                              "session_kwargs": session_kwargs,
@@ -60,3 +51,23 @@ async def _producer(session, queue, url, base_path, session_kwargs):
             tasks.append(asyncio.ensure_future(coroutine))
 
     await asyncio.gather(*tasks)
+
+
+def parse_index(page):
+    soup = BeautifulSoup(page.text, BEAUTIFUL_SOUP_PARSER)
+
+    result = []
+    for link in soup.find_all("a"):
+        href = link.get("href")
+        if href != str(link.string).strip():
+            continue
+
+        if href[-1] == "/":
+            href = href[:-1]
+
+        checksum = None
+        if "." in href:
+            checksum = str(link.next_sibling.string).strip()
+        result.append([href, checksum])
+
+    return result
@@ -1,3 +1,4 @@
+API_URL = "https://api.onedrive.com/v1.0/"
 
-
-
+CRAWLER_DELTA = "delta"
+CRAWLER_RECURSIVE = "recursive"
@@ -1,28 +1,47 @@
 import asyncio
+import json
+import logging
 from urllib.parse import parse_qs, urlparse
 
 import aiohttp
 
-from settings.config import ConfigString
+from settings.config_objs import ConfigOptions, ConfigString
+from core.archive_download import get_pending_items
+from core.storage import cache
 from core.storage.cache import check_url_reference
 from core.storage.utils import call_function_or_cache
 from core.utils import safe_path_join
+from sites.one_drive.constants import *
+
+logger = logging.getLogger(__name__)
 
 URL_CONFIG = ConfigString(gui_name="Url")
+CRAWLER_CONFIG = ConfigOptions(default=CRAWLER_DELTA,
+                               options=[CRAWLER_DELTA, CRAWLER_RECURSIVE],
+                               optional=True,
+                               gui_name="Crawler",
+                               hint_text="delta: Lists the whole folder with a few requests "
+                                         "and afterwards only the changes.<br>"
+                                         "recursive: Lists folder by folder")
 
 
-def get_api_url(parameters, children=True):
+def get_ids(parameters):
     authkey = parameters['authkey'][0]
     if "resid" in parameters:
         one_id = parameters['resid'][0]
     else:
         one_id = parameters['id'][0]
     driver_id = one_id.split('!')[0]
+    return driver_id, one_id, authkey
+
 
-    child_string = "/children" if children else ""
+def get_item_url(driver_id, one_id, authkey, suffix=""):
+    return f"{API_URL}drives/{driver_id}/items/{one_id}{suffix}?authkey={authkey}"
 
-    api_url = f"https://api.onedrive.com/v1.0/drives/{driver_id}/items/{one_id}{child_string}?authkey={authkey}"
-    return api_url
+
+def get_api_url(parameters, children=True):
+    driver_id, one_id, authkey = get_ids(parameters)
+    return get_item_url(driver_id, one_id, authkey, "/children" if children else "")
 
 
 async def get_folder_name(session, url, **kwargs):
@@ -35,19 +54,134 @@ async def get_folder_name(session, url, **kwargs):
     return item_data["name"]
 
 
-async def producer(session, queue, base_path, site_settings, url: URL_CONFIG):
+async def change_token(session, url, **kwargs):
+    """lastModifiedDateTime of the root item changes whenever anything below it changes"""
+    parameters = parse_qs(urlparse(url).query)
+    api_url = get_api_url(parameters, children=False)
+
+    async with session.get(api_url) as response:
+        item_data = await response.json()
+
+    return item_data.get("lastModifiedDateTime", None)
+
+
+async def producer(session, queue, base_path, site_settings, url: URL_CONFIG,
+                   crawler: CRAWLER_CONFIG = CRAWLER_DELTA):
+    if crawler == CRAWLER_DELTA:
+        try:
+            return await _delta_producer(session, queue, base_path, site_settings, url)
+        except aiohttp.ClientResponseError as e:
+            logger.warning(f"Delta query of {url} failed with status {e.status}. Listing folder by folder")
+    elif crawler != CRAWLER_RECURSIVE:
+        raise ValueError(f"crawler value: {crawler} not allowed")
+
     await _producer(session, queue, base_path, site_settings, url)
 
 
+async def _delta_producer(session, queue, base_path, site_settings, url):
+    """
+    Lists the tree with the delta query. The returned deltaLink is stored with the known items,
+    so the next run only fetches the items which changed since. Stored files which didn't change
+    are put into the queue again if they are missing or changed locally and recorded otherwise.
+    """
+    driver_id, root_id, authkey = get_ids(parse_qs(urlparse(url).query))
+    delta_table = cache.get_json("one_drive_delta")
+    cache_key = f"{driver_id}/{root_id}"
+    state = delta_table.get(cache_key, None)
+
+    if state is None:
+        state = {"delta_link": None, "items": {}}
+    try:
+        changes, delta_link = await get_delta(session, state["delta_link"] or
+                                              get_item_url(driver_id, root_id, authkey, "/delta"))
+    except aiohttp.ClientResponseError as e:
+        if e.status != 410 or state["delta_link"] is None:
+            raise e
+        # The delta token expired, so everything has to be listed again
+        state = {"delta_link": None, "items": {}}
+        changes, delta_link = await get_delta(session, get_item_url(driver_id, root_id, authkey, "/delta"))
+
+    items = state["items"]
+    download_urls = {}
+    for item in changes:
+        if item["id"] == root_id:
+            continue
+        if "deleted" in item:
+            items.pop(item["id"], None)
+            continue
+
+        items[item["id"]] = {
+            "name": item["name"],
+            "parent": item.get("parentReference", {}).get("id", None),
+            "folder": "folder" in item,
+            "checksum": item.get("file", {}).get("hashes", {}).get("sha256Hash", None),
+        }
+        if "@content.downloadUrl" in item:
+            download_urls[item["id"]] = item["@content.downloadUrl"]
+
+    unchanged = []
+    for one_id, item in items.items():
+        if item["folder"]:
+            continue
+
+        path = get_delta_path(items, root_id, one_id)
+        if path is None:
+            logger.debug(f"Could not find the path of the one drive item {one_id}")
+            continue
+
+        queue_item = {"path": safe_path_join(base_path, path),
+                      "url": download_urls.get(one_id, None) or get_item_url(driver_id, one_id, authkey, "/content"),
+                      "checksum": item["checksum"]}
+        if one_id in download_urls:
+            await queue.put(queue_item)
+        else:
+            unchanged.append(queue_item)
+
+    pending = await get_pending_items(queue, unchanged, site_settings)
+    pending_ids = {id(queue_item) for queue_item in pending}
+    for queue_item in unchanged:
+        if id(queue_item) in pending_ids:
+            await queue.put(queue_item)
+        else:
+            queue.record(queue_item)
+
+    delta_table[cache_key] = {"delta_link": delta_link, "items": items}
+
+
+async def get_delta(session, url):
+    """Follows the nextLinks of a delta query and returns all changed items and the new deltaLink"""
+    changes = []
+    while True:
+        async with session.get(url) as response:
+            data = await response.json()
+
+        changes += data["value"]
+        if "@odata.nextLink" in data:
+            url = data["@odata.nextLink"]
+        else:
+            return changes, data.get("@odata.deltaLink", None)
+
+
+def get_delta_path(items, root_id, one_id):
+    names = []
+    while one_id != root_id:
+        item = items.get(one_id, None)
+        if item is None:
+            return None
+        names.append(item["name"])
+        one_id = item["parent"]
+    return safe_path_join("", *reversed(names))
+
+
 async def _producer(session, queue, base_path, site_settings, url, etag=None):
     parameters = parse_qs(urlparse(url).query)
     api_url = get_api_url(parameters, children=True)
     authkey = parameters['authkey'][0]
 
-    item_data = await call_function_or_cache(get_json_response, etag, session, api_url)
+    children = await call_function_or_cache(get_children, etag, session, api_url)
 
     tasks = []
-    for item in item_data["value"]:
+    for item in children:
         path = safe_path_join(base_path, item["name"])
         if "@content.downloadUrl" in item:
             checksum = item["file"]["hashes"]["sha256Hash"]
@@ -63,9 +197,22 @@ async def _producer(session, queue, base_path, site_settings, url, etag=None):
     await asyncio.gather(*tasks)
 
 
+async def get_children(session, api_url):
+    data = await get_json_response(session, api_url)
+    children = data["value"]
+    while "@odata.nextLink" in data:
+        data = await get_json_response(session, data["@odata.nextLink"])
+        children += data["value"]
+    return children
+
+
 async def get_json_response(session, api_url):
-    async with session.get(api_url) as response:
-        return await response.json()
+    page = await session.get_page(api_url, parser=parse_json)
+    return page.parsed
+
+
+def parse_json(page):
+    return json.loads(page.text)
 
 
 if __name__ == "__main__":
@@ -6,6 +6,29 @@ PROPFIND_DATA = """<?xml version="1.0"?>
     </a:prop>
 </a:propfind>"""
 
+PROPFIND_DEPTH_DATA = """<?xml version="1.0"?>
+<a:propfind xmlns:a="DAV:">
+    <a:prop xmlns:oc="http://owncloud.org/ns">
+        <oc:checksums/>
+        <a:getcontenttype/>
+        <a:getetag/>
+        <a:resourcetype/>
+    </a:prop>
+</a:propfind>"""
+
+PROPFIND_ETAG_DATA = """<?xml version="1.0"?>
+<a:propfind xmlns:a="DAV:">
+    <a:prop>
+        <a:getetag/>
+    </a:prop>
+</a:propfind>"""
+
+CRAWL_FULL = "full"
+CRAWL_DEPTH = "depth"
+
+PROPFIND_CHUNK_SIZE = 64 * 1024
+DAV_RESPONSE_TAG = "{DAV:}response"
+
 BASE_URL = "https://polybox.ethz.ch"
 WEBDAV_PUBLIC_URL = "https://polybox.ethz.ch/public.php/webdav/"
 WEBDAV_REMOTE_URL = "https://polybox.ethz.ch/remote.php/webdav/"
@@ -19,4 +42,14 @@ BASIC_HEADER = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:74.0) Gecko/20100101 Firefox/74.0",
 }
 
+ROOT_HEADER = {
+    **BASIC_HEADER,
+    "Depth": "0",
+}
+
+DEPTH_HEADER = {
+    **BASIC_HEADER,
+    "Depth": "1",
+}
+
 
@@ -11,8 +11,10 @@ from urllib.parse import unquote, quote, urlparse
 from bs4 import BeautifulSoup
 from aiohttp import BasicAuth
 
+from core import io_executor
+from core.archive_download import ItemCollector, get_pending_items, put_folder_items
 from core.constants import BEAUTIFUL_SOUP_PARSER
-from core.monitor import MonitorSession
+from core.storage import cache
 from core.utils import safe_path_join
 from core.storage.utils import call_function_or_cache
 from settings.config_objs import ConfigOptions, ConfigString
@@ -28,6 +30,13 @@ POLY_TYPE_CONFIG = ConfigOptions(default="s",
                                            "Type f: Private folder (your own polybox)")
 POLY_ID_CONFIG = ConfigString(gui_name="ID")
 PASSWORD_CONFIG = ConfigString(gui_name="Password", optional=True)
+CRAWL_MODE_CONFIG = ConfigOptions(default=CRAWL_FULL,
+                                  options=[CRAWL_FULL, CRAWL_DEPTH],
+                                  optional=True,
+                                  gui_name="Crawl Mode",
+                                  hint_text="full: Lists the whole folder with one request.<br>"
+                                            "depth: Lists folder by folder and skips "
+                                            "subfolders which didn't change")
 
 
 async def login_folder(session, poly_type, poly_id, password, **kwargs):
@@ -56,10 +65,10 @@ async def _get_dire_path(session, site_settings, poly_type, poly_id):
     return dir_path
 
 
-async def get_folder_name(session, site_settings, poly_id, poly_type="s", password=None):
-    # We create a new session, because polybox doesn't work
+async def get_folder_name(session, site_settings, poly_id, poly_type="s", password=None, **kwargs):
+    # We use a session with its own cookies, because polybox doesn't work
     # when you jump around with the same session
-    async with MonitorSession(raise_for_status=True, signals=session.signals) as session:
+    async with session.isolated() as session:
         if poly_type == "s":
             return await _get_folder_name_s(session=session,
                                             poly_type=poly_type,
@@ -104,42 +113,87 @@ async def _get_folder_name_f(session, site_settings, poly_type, poly_id):
     return "Polybox Root Folder"
 
 
+async def change_token(session, site_settings, poly_id, poly_type="s", password=None, **kwargs):
+    """The ETag of an ownCloud folder changes whenever anything below it changes"""
+    if poly_type == "s":
+        url = WEBDAV_PUBLIC_URL
+        auth = BasicAuth(login=poly_id,
+                         password="null" if password is None else password)
+    elif poly_type == "f":
+        dir_path = await _get_dire_path(session=session,
+                                        site_settings=site_settings,
+                                        poly_type=poly_type,
+                                        poly_id=poly_id)
+        url = f"{USER_WEBDAV_URL}{site_settings.username}{dir_path}"
+        auth = BasicAuth(login=site_settings.username,
+                         password=site_settings.password)
+    else:
+        raise ValueError(f"poly_type value: {poly_type} not allowed")
+
+    async with session.request("PROPFIND", url=url, data=PROPFIND_ETAG_DATA,
+                               headers=ROOT_HEADER, auth=auth) as response:
+        xml = await response.text()
+
+    tree = ET.fromstring(xml)
+    return go_down_tree(tree, "d:response", "d:propstat", "d:prop", "d:getetag", to_text=True)
+
+
 async def producer(session,
                    queue,
                    base_path,
                    site_settings,
                    poly_id: POLY_ID_CONFIG,
                    poly_type: POLY_TYPE_CONFIG = "s",
-                   password: PASSWORD_CONFIG = None):
+                   password: PASSWORD_CONFIG = None,
+                   crawl_mode: CRAWL_MODE_CONFIG = CRAWL_FULL):
     if poly_type == "f":
         await _producer_f(session=session,
                           queue=queue,
                           base_path=base_path,
                           site_settings=site_settings,
                           poly_type=poly_type,
-                          poly_id=poly_id)
+                          poly_id=poly_id,
+                          crawl_mode=crawl_mode)
     elif poly_type == "s":
         await _producer_s(session=session,
                           queue=queue,
                           base_path=base_path,
+                          site_settings=site_settings,
                           poly_id=poly_id,
-                          password=password)
+                          password=password,
+                          crawl_mode=crawl_mode)
     else:
         raise ValueError(f"poly_type value: {poly_type} not allowed")
 
 
-async def _producer_s(session, queue, base_path, poly_id, password):
+async def _producer_s(session, queue, base_path, site_settings, poly_id, password, crawl_mode):
     auth = BasicAuth(login=poly_id,
                      password="null" if password is None else password)
 
-    await _parse_tree(session=session,
-                      queue=queue,
-                      base_path=base_path,
-                      url=WEBDAV_PUBLIC_URL,
-                      auth=auth)
-
-
-async def _producer_f(session, queue, base_path, site_settings, poly_type, poly_id):
+    # Only a new share is downloaded as archive. Otherwise the items are put into the queue
+    # while the listing arrives. The archive download needs the session cookie of a password login
+    if password is not None or await io_executor.exists(os.path.join(site_settings.base_path, base_path)):
+        await _crawl(session=session,
+                     queue=queue,
+                     base_path=base_path,
+                     site_settings=site_settings,
+                     url=WEBDAV_PUBLIC_URL,
+                     auth=auth,
+                     crawl_mode=crawl_mode)
+        return
+
+    collector = ItemCollector(queue)
+    await _crawl(session=session,
+                 queue=collector,
+                 base_path=base_path,
+                 site_settings=site_settings,
+                 url=WEBDAV_PUBLIC_URL,
+                 auth=auth,
+                 crawl_mode=crawl_mode)
+    await put_folder_items(session, queue, collector.items, INDEX_URL + f"s/{poly_id}/download", base_path)
+
+
+async def _producer_f(session, queue, base_path, site_settings, poly_type, poly_id, crawl_mode):
     dir_path = await _get_dire_path(session=session,
                                     site_settings=site_settings,
                                     poly_type=poly_type,
@@ -152,46 +206,151 @@ async def _producer_f(session, queue, base_path, site_settings, poly_type, poly_
     auth = BasicAuth(login=site_settings.username,
                      password=site_settings.password)
 
-    await _parse_tree(session=session,
-                      queue=queue,
-                      base_path=base_path,
-                      url=url,
-                      auth=auth,
-                      cut_parts_num=cut_parts_num)
+    await _crawl(session=session,
+                 queue=queue,
+                 base_path=base_path,
+                 site_settings=site_settings,
+                 url=url,
+                 auth=auth,
+                 crawl_mode=crawl_mode,
+                 cut_parts_num=cut_parts_num)
+
+
+async def _crawl(session, queue, base_path, site_settings, url, auth, crawl_mode, cut_parts_num=3):
+    if crawl_mode == CRAWL_DEPTH:
+        await _parse_tree_by_depth(session=session,
+                                   queue=queue,
+                                   base_path=base_path,
+                                   site_settings=site_settings,
+                                   url=url,
+                                   auth=auth,
+                                   cut_parts_num=cut_parts_num)
+    elif crawl_mode == CRAWL_FULL:
+        await _parse_tree(session=session,
+                          queue=queue,
+                          base_path=base_path,
+                          url=url,
+                          auth=auth,
+                          cut_parts_num=cut_parts_num)
+    else:
+        raise ValueError(f"crawl_mode value: {crawl_mode} not allowed")
 
 
 async def _parse_tree(session, queue, base_path, url, auth, cut_parts_num=3):
-    tasks = []
-
     async with session.request("PROPFIND", url=url, data=PROPFIND_DATA, headers=BASIC_HEADER, auth=auth) as response:
-        xml = await response.text()
-
-    tree = ET.fromstring(xml)
-
-    for response in tree:
-        href = go_down_tree(response, "d:href", to_text=True)
-        prop = go_down_tree(response, "d:propstat", "d:prop")
-        checksum = go_down_tree(prop, "oc:checksums", "oc:checksum", to_text=True)
-        contenttype = go_down_tree(prop, "d:getcontenttype", to_text=True)
-        if contenttype is None:
-            continue
-
-        path = PurePath(unquote(href))
-        path = safe_path_join("", *path.parts[cut_parts_num:])
-
-        if not path:
-            raise ValueError("Can not download single file")
-
-        url = BASE_URL + href
-        absolute_path = os.path.join(base_path, path)
-
-        await queue.put({"url": url,
-                         "path": absolute_path,
-                         "checksum": checksum,
-                         "session_kwargs": {"auth": auth},
-                         })
-
-    await asyncio.gather(*tasks)
+        async for element in iter_responses(response):
+            href = go_down_tree(element, "d:href", to_text=True)
+            prop = go_down_tree(element, "d:propstat", "d:prop")
+            checksum = go_down_tree(prop, "oc:checksums", "oc:checksum", to_text=True)
+            contenttype = go_down_tree(prop, "d:getcontenttype", to_text=True)
+            if contenttype is None:
+                continue
+
+            await queue.put(_get_item(href, checksum, base_path, auth, cut_parts_num))
+
+
+async def _parse_tree_by_depth(session, queue, base_path, site_settings, url, auth, cut_parts_num=3):
+    """
+    Lists the tree folder by folder with Depth: 1. The ETag of an ownCloud folder changes whenever
+    anything below it changes, so subfolders with the ETag of the last run are not listed again,
+    as long as their files are still the same locally. Their files are recorded from the last run.
+    """
+    etag_table = cache.get_json("polybox_etag")
+    cache_key = f"{auth.login}@{url}"
+    old_folders = etag_table.get(cache_key, {})
+    folders = {}
+
+    folder_urls = [url]
+    while folder_urls:
+        listings = await asyncio.gather(*[_list_folder(session, folder_url, auth) for folder_url in folder_urls])
+        folder_urls = []
+        for folder, files, sub_folders in listings:
+            folders[folder["href"]] = {"etag": folder["etag"], "files": files}
+
+            for href, checksum in files:
+                await queue.put(_get_item(href, checksum, base_path, auth, cut_parts_num))
+
+            for href, etag in sub_folders:
+                sub_tree = {key: value for key, value in old_folders.items() if key.startswith(href)}
+                if etag is None or sub_tree.get(href, {}).get("etag", None) != etag:
+                    folder_urls.append(BASE_URL + href)
+                    continue
+
+                items = [_get_item(file_href, checksum, base_path, auth, cut_parts_num)
+                         for sub_folder in sub_tree.values() for file_href, checksum in sub_folder["files"]]
+                if await get_pending_items(queue, items, site_settings):
+                    folder_urls.append(BASE_URL + href)
+                    continue
+
+                folders.update(sub_tree)
+                for item in items:
+                    queue.record(item)
+
+    etag_table[cache_key] = folders
+
+
+async def _list_folder(session, url, auth):
+    folder = None
+    files = []
+    sub_folders = []
+    async with session.request("PROPFIND", url=url, data=PROPFIND_DEPTH_DATA, headers=DEPTH_HEADER,
+                               auth=auth) as response:
+        async for element in iter_responses(response):
+            href = go_down_tree(element, "d:href", to_text=True)
+            prop = go_down_tree(element, "d:propstat", "d:prop")
+            etag = go_down_tree(prop, "d:getetag", to_text=True)
+            is_collection = go_down_tree(prop, "d:resourcetype", "d:collection") is not None
+
+            if folder is None:
+                # The first response is the listed folder itself
+                if not is_collection:
+                    raise ValueError("Can not download single file")
+                folder = {"href": href, "etag": etag}
+            elif is_collection:
+                sub_folders.append([href, etag])
+            elif go_down_tree(prop, "d:getcontenttype", to_text=True) is not None:
+                files.append([href, go_down_tree(prop, "oc:checksums", "oc:checksum", to_text=True)])
+
+    return folder, files, sub_folders
+
+
+def _get_item(href, checksum, base_path, auth, cut_parts_num):
+    path = PurePath(unquote(href))
+    path = safe_path_join("", *path.parts[cut_parts_num:])
+
+    if not path:
+        raise ValueError("Can not download single file")
+
+    return {"url": BASE_URL + href,
+            "path": os.path.join(base_path, path),
+            "checksum": checksum,
+            "session_kwargs": {"auth": auth},
+            }
+
+
+async def iter_responses(response):
+    """
+    Parses the multistatus body while it arrives and yields its d:response elements one by one.
+    Yielded elements are cleared afterwards, so only one of them is held in memory.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    async for chunk in response.content.iter_chunked(PROPFIND_CHUNK_SIZE):
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = element
+                continue
+
+            if element.tag != DAV_RESPONSE_TAG:
+                continue
+
+            yield element
+            element.clear()
+            root.remove(element)
+
+    parser.close()
 
 
 def go_down_tree(tree, *args, to_text=False):
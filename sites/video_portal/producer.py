@@ -1,6 +1,7 @@
 import asyncio
 import os
 
+from core import io_executor
 from core.utils import safe_path_join
 from settings.config import ConfigString
 from sites.video_portal.constants import BASE_URL
@@ -45,8 +46,8 @@ async def producer(session,
 
     meta_data = await get_meta_data(session, course_url)
 
-    if os.path.exists(absolute_path):
-        downloaded_episodes = os.listdir(absolute_path)
+    if await io_executor.exists(absolute_path):
+        downloaded_episodes = await io_executor.listdir(absolute_path)
     else:
         downloaded_episodes = []
 
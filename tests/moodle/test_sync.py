@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("bs4")
+
+from core.storage import cache
+from sites.moodle.parser import parse_update_json
+from sites.moodle.sync import SyncCursor
+
+KEY = "kwargs_hash:Moodle Course"
+
+
+@pytest.fixture
+def sync_table(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "loaded_jsons", {})
+    cache.set_json("moodle_sync", {
+        KEY: {
+            "since": int(time.time()) - 3600,
+            "modules": {"5": 1000},
+            "items": {"5": []},
+            "last_full_sync": time.time(),
+        },
+    }, str(tmp_path / "moodle_sync.json"))
+
+
+def get_update_response(*updates):
+    return {
+        "error": False,
+        "data": {
+            "instances": [{"contextlevel": "module", "id": 5, "updates": list(updates)}],
+        },
+    }
+
+
+def test_contentfiles_update_changes_last_update(sync_table):
+    cursor = SyncCursor(KEY, moodle_id=1)
+    assert not cursor.full_sync
+
+    response = get_update_response({"name": "contentfiles", "timeupdated": 2000, "itemids": [1]})
+    last_updated = cursor.apply_updates(parse_update_json(response, strict=False))
+
+    assert last_updated[5] == 2000
+    assert 5 in cursor.changed
+
+
+def test_latest_area_wins(sync_table):
+    cursor = SyncCursor(KEY, moodle_id=1)
+
+    response = get_update_response({"name": "configuration", "timeupdated": 1500},
+                                   {"name": "introfiles", "timeupdated": 3000})
+    last_updated = cursor.apply_updates(parse_update_json(response, strict=False))
+
+    assert last_updated[5] == 3000
+
+
+def test_update_without_time_uses_sync_time(sync_table):
+    cursor = SyncCursor(KEY, moodle_id=1)
+
+    response = get_update_response({"name": "contentfiles", "itemids": [1]})
+    last_updated = cursor.apply_updates(parse_update_json(response, strict=False))
+
+    assert last_updated[5] == int(cursor.start)